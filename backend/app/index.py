@@ -0,0 +1,74 @@
+import argparse
+import fcntl
+import os
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from app.services.IndexManifest import IndexManifest
+
+if TYPE_CHECKING:
+    # Imported where needed, `status` and the API's startup shouldn't wait for Haystack
+    from app.services.RAG import RAGService
+
+# python -m app.index build
+# A single markdown file or a corpus directory of several games, see app.services.Corpus
+DEFAULT_CORPUS_PATH = os.getenv("CORPUS_PATH", "data/processed_documents/DRG_2E_Rulebook_docling.md")
+LOCK_PATH = Path(__file__).parent.parent / "data" / "index.lock"
+
+
+def build_index_once(
+    rag_service: "RAGService",
+    path_to_markdown: str = DEFAULT_CORPUS_PATH,
+    incremental: bool = True
+) -> bool:
+    """
+    Leader-elected index build for multi-worker startup.
+
+    The first process to take the lock builds the index, every other process
+    waits for it to finish and then attaches to the result.
+    """
+    LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_PATH, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("Another process is building the index, waiting for it...")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return rag_service.attach_index()
+        try:
+            return rag_service.build_embeddings(path_to_markdown=path_to_markdown, incremental=incremental)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.index", description="Manage the Rules Lawyer vector index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Embed the rulebook into Neo4j and write the version marker.")
+    build_parser.add_argument("--source", default=DEFAULT_CORPUS_PATH, help="Markdown file or corpus directory to index.")
+    build_parser.add_argument("--full", action="store_true", help="Recreate the vector index and re-embed every chunk instead of only changed ones.")
+
+    subparsers.add_parser("status", help="Print the version of the built index.")
+
+    args = parser.parse_args()
+
+    if args.command == "status":
+        manifest = IndexManifest()
+        if not manifest.path.exists():
+            print("Index has not been built.")
+            return 1
+        manifest.load()
+        print(f"Index {manifest.version}: {len(manifest.hashes)} chunks, embedding model {manifest.embedding_model}")
+        return 0
+
+    from app.services.RAG import RAGService
+    rag_service = RAGService()
+    built = build_index_once(rag_service, path_to_markdown=args.source, incremental=not args.full)
+    return 0 if built else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,186 @@
+import asyncio
+import json
 import os
 import secrets
+import threading
+import time
+from contextlib import AsyncExitStack
 from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Union
 
 from app.routers import auth
-from app.services.RAG import RAGService
+from app.services.Corpus import UnknownGame
+from app.services.GenerationScheduler import GenerationRejected
+from app.utils import metrics
 from app.utils.auth import verify_token
+from app.utils.concurrency import ConcurrencyLimiter, max_concurrent_queries
+from app.utils.readiness import Readiness
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+
+if TYPE_CHECKING:
+    # Haystack, neo4j-haystack and the Ollama integrations take about a second to import,
+    # they are loaded by warm_up so the server starts answering probes right away
+    from app.services.RAG import RAGService
 
 # .venv/bin/uvicorn app.main:app --reload --host 127.0.0.1 --port 8000
 load_dotenv(dotenv_path=Path(__file__).parent.parent / ".env", override=False)
 
+# Questions answered concurrently by this worker, extra ones queue up to RAG_MAX_QUEUED_QUERIES then get a 429.
+# A queued question gets a 503 after the same GENERATION_QUEUE_TIMEOUT as a generation waiting for a backend
+query_limiter = ConcurrencyLimiter(
+    max_concurrency=max_concurrent_queries(),
+    max_queued=int(os.getenv("RAG_MAX_QUEUED_QUERIES", "16")),
+    queue_timeout=float(os.getenv("GENERATION_QUEUE_TIMEOUT", "30")))
+metrics.REGISTRY.register(metrics.Gauge(
+    "rag_pending_queries", "Questions running or waiting for a slot, over all workers.",
+    callback=lambda: {(): query_limiter.pending}))
+# A batch takes one slot and answers up to RAG_BATCH_CONCURRENCY of its questions at once
+max_batch_size = int(os.getenv("RAG_MAX_BATCH_SIZE", "100"))
+batch_concurrency = int(os.getenv("RAG_BATCH_CONCURRENCY", "2"))
+
+
+class BatchQuestion(BaseModel):
+    question: str = Field(min_length=1)
+    game: Optional[str] = None
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[BatchQuestion]
+    game: Optional[str] = None  # Default for questions that don't name one
+    stream: bool = False
+
+
+def _batch_result(
+    items: list, index: int, answer: Optional[str], rejection: Optional[Union[GenerationRejected, UnknownGame]]
+) -> dict:
+    question, game = items[index]
+    result = {"index": index, "question": question, "game": game, "answer": answer}
+    if rejection is not None:
+        result["error"] = {"status": rejection.status_code, "detail": rejection.detail}
+    return result
+
+def _timings_ms(timings: dict, start: float) -> dict:
+    return {**{stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+            "total": round((time.perf_counter() - start) * 1000, 1)}
+
+def load_rag_service(app: FastAPI) -> None:
+    """Steps of warm_up before the models: imports, RAG service, index and query pipeline. Completed steps are kept on retry."""
+    readiness: Readiness = app.state.readiness
+    readiness.enter(Readiness.IMPORTING)
+    from app.index import DEFAULT_CORPUS_PATH, build_index_once
+    from app.services.RAG import RAGService
+    if getattr(app.state, "rag_service", None) is None:
+        print(f"{'#'*80}\nInitializing RAG service...\n{'#'*80}")
+        app.state.rag_service = RAGService()  # Initialize RAG service
+    readiness.enter(Readiness.LOADING_INDEX)
+    if os.getenv("INDEX_BUILD_ON_STARTUP", "true").lower() == "true":
+        print(f"{'#'*80}\nBuilding embeddings...\n{'#'*80}")
+        loaded = build_index_once(app.state.rag_service, path_to_markdown=DEFAULT_CORPUS_PATH)
+    else:
+        # Index is built once per deployment by `python -m app.index build`
+        print(f"{'#'*80}\nAttaching to prebuilt index...\n{'#'*80}")
+        loaded = app.state.rag_service.attach_index()
+    if not loaded:
+        raise RuntimeError("the index could not be built or attached")
+    readiness.index_loaded(app.state.rag_service.index_version)
+    readiness.enter(Readiness.BUILDING_PIPELINE)
+    print(f"{'#'*80}\nBuilding query pipeline...\n{'#'*80}")
+    if not app.state.rag_service.build_query_pipeline():
+        raise RuntimeError("the query pipeline could not be built")
+
+def warm_up(app: FastAPI) -> None:
+    """
+    Load the RAG service in the background: heavy imports, index, query pipeline, then the Ollama models.
+    Progress goes to app.state.readiness. Every step is retried with backoff until it succeeds,
+    e.g. while Neo4j or Ollama are still starting, the worker stays not ready meanwhile.
+    Once ready, answers to the FAQ_WARMUP_TOP_N most asked questions are precomputed (see RAGService.precompute_faq).
+    """
+    readiness: Readiness = app.state.readiness
+    delay = 1.0
+    while not app.state.shutting_down.is_set():
+        try:
+            load_rag_service(app)
+            break
+        except Exception as e:
+            print(f"Error in warm_up, retrying in {delay:.0f}s: {e}")
+            readiness.retrying(str(e))
+            app.state.shutting_down.wait(delay)
+            delay = min(delay * 2, 30.0)
+    else:
+        return
+
+    faq_top_n = int(os.getenv("FAQ_WARMUP_TOP_N", "50"))
+    if faq_top_n > 0:
+        # Answers precomputed for this index version by an earlier run are served from the start
+        try:
+            readiness.faq_updated("loaded", app.state.rag_service.load_faq_answers())
+        except Exception as e:
+            print(f"Error in load_faq_answers: {e}")
+    readiness.enter(Readiness.WARMING_MODELS)
+    if os.getenv("WARMUP_MODELS", "true").lower() != "true":
+        readiness.mark_ready(models_state="cold")
+    delay = 1.0
+    while not readiness.ready and not app.state.shutting_down.is_set():
+        try:
+            app.state.rag_service.warm_up_models()
+            readiness.mark_ready()
+            print(f"{'#'*80}\nRAG service ready after {readiness.snapshot()['ready_after_seconds']}s\n{'#'*80}")
+        except Exception as e:
+            print(f"Error in warm_up_models, retrying in {delay:.0f}s: {e}")
+            readiness.models_failed(str(e))
+            app.state.shutting_down.wait(delay)
+            delay = min(delay * 2, 30.0)
+    if not readiness.ready:
+        return
+
+    if faq_top_n <= 0:
+        readiness.faq_updated("disabled", 0)
+        return
+    # The most asked questions of the query log get answered while the worker already serves
+    readiness.faq_updated("precomputing", readiness.faq_answers)
+    try:
+        answers = app.state.rag_service.precompute_faq(faq_top_n, stop=app.state.shutting_down)
+        readiness.faq_updated("done", answers)
+    except Exception as e:
+        print(f"Error in precompute_faq: {e}")
+        readiness.faq_updated("failed", readiness.faq_answers)
+
+def ready_rag_service() -> "RAGService":
+    """The RAG service once warm-up is done, a 503 before that so the client retries (or nginx picks another worker)."""
+    readiness: Readiness = app.state.readiness
+    if not readiness.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Service is not ready ({readiness.phase})",
+            headers={"Retry-After": "5"})
+    return app.state.rag_service
+
+def record_question(rag_service: "RAGService", question: str, game: Optional[str]) -> None:
+    """Counts the question in the query log off the event loop, the answer doesn't wait for the write."""
+    asyncio.get_running_loop().run_in_executor(None, rag_service.record_question, question, game)
+
 async def lifespan(app: FastAPI):
     # Startup actions
     print(f"{'#'*80}\nStarting up the Rules Lawyer API...\n{'#'*80}")
-    print(f"{'#'*80}\nInitializing RAG service...\n{'#'*80}")
-    app.state.rag_service = RAGService()  # Initialize RAG service
-    print(f"{'#'*80}\nBuilding embeddings...\n{'#'*80}")
-    app.state.rag_service.build_embeddings(
-        path_to_markdown="data/processed_documents/DRG_2E_Rulebook_docling.md")
-    print(f"{'#'*80}\nBuilding query pipeline...\n{'#'*80}")
-    app.state.rag_service.build_query_pipeline()
+    # Every worker serves the metrics of all of them on /metrics
+    metrics.REGISTRY.share(interval=float(os.getenv("METRICS_FLUSH_SECONDS", "1")))
+    warm_up_thread = threading.Thread(target=warm_up, args=(app,), name="rag-warm-up", daemon=True)
+    warm_up_thread.start()
+    if os.getenv("FAST_START", "false").lower() != "true":
+        # Serve once the index and pipeline are loaded, the models keep warming up in the background
+        await asyncio.to_thread(app.state.readiness.wait_loaded)
     print(f"{'#'*80}\nPre-Startup complete. Server is running...\n{'#'*80}")
     yield # Server is running
     # Shutdown actions
     print(f"{'#'*80}\nShutting down the Rules Lawyer API...\n{'#'*80}")
+    app.state.shutting_down.set()
+    if getattr(app.state, "rag_service", None) is not None:
+        app.state.rag_service.close()
 
 app = FastAPI(
     title="Rules Lawyer API",
@@ -34,6 +188,20 @@ app = FastAPI(
     version="0.1.0",
     lifespan=lifespan
 )
+app.state.readiness = Readiness()
+app.state.shutting_down = threading.Event()
+
+@app.exception_handler(GenerationRejected)
+async def generation_rejected_handler(request, exc: GenerationRejected) -> JSONResponse:
+    # Overload fails fast: 429 when the generation queue is full, 503 when no backend freed up in time
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)})
+
+@app.exception_handler(UnknownGame)
+async def unknown_game_handler(request, exc: UnknownGame) -> JSONResponse:
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
 # CORS middleware
 app.add_middleware(
@@ -51,9 +219,39 @@ app.include_router(auth.router)
 async def root():
     return {"message": "Welcome to Rules Lawyer API"}
 
+@app.get("/health/live", response_model=dict)
+async def liveness_check():
+    """The process is up and its event loop responds, whatever the warm-up state."""
+    return {"status": "alive", "phase": app.state.readiness.phase}
+
+@app.get("/health/ready", response_model=dict)
+async def readiness_check(response: Response, check: bool = False):
+    """
+    200 once this worker can answer questions, 503 while warming up or after a failed start.
+    With check=true the pooled Ollama and Neo4j connections are also tried, a failing one is a 503.
+    """
+    state = app.state.readiness.snapshot()
+    state["models"].update(
+        embedding=os.getenv("OLLAMA_EMBEDDING_MODEL"), generative=os.getenv("OLLAMA_GENERATIVE_MODEL"))
+    if check and getattr(app.state, "rag_service", None) is not None:
+        state["backends"] = await asyncio.to_thread(app.state.rag_service.clients.health)
+        if not all(backend["ok"] for backend in state["backends"].values()):
+            state["status"] = "degraded"
+    if state["status"] != "ready":
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return state
+
 @app.get("/health", response_model=dict)
-async def health_check():
-    return {"status": "healthy"}
+async def health_check(response: Response):
+    """Kept for existing health checks, same as /health/ready."""
+    return await readiness_check(response)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_api() -> PlainTextResponse:
+    """Prometheus metrics of all workers: stage timings, token and document counts, cache hits."""
+    # Reads the other workers' snapshots from disk
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 @app.get("/favicon.ico")
 async def favicon():
@@ -67,11 +265,108 @@ def protected_route(token_data: dict = Depends(verify_token)):
 @app.get("/query", response_model=dict)
 async def query_api(
     question: str,
+    game: Optional[str] = None,
+    timings: bool = False,
     token_data: dict = Depends(verify_token)
 ) -> dict:
     if not question:
         return {"question": question, "answer": "No question provided."}
-    rag_service: RAGService = app.state.rag_service
-    answer: str = rag_service.query(question)
-    return {"question": question, "answer": answer}
+    rag_service: RAGService = ready_rag_service()
+    record_question(rag_service, question, game)
+    start = time.perf_counter()
+    # Collect the per-stage breakdown only when asked for
+    stage_timings = {} if timings else None
+    metrics.request_timings.set(stage_timings)
+    # Duplicate in-flight questions wait on the first one and don't take a slot of their own
+    answer: str = await rag_service.aquery(question, game=game, admission=query_limiter.slot)
+    response = {"question": question, "game": game, "answer": answer}
+    if stage_timings is not None:
+        response["timings"] = _timings_ms(stage_timings, start)
+    return response
+
+
+@app.get("/query/stream")
+async def query_stream_api(
+    question: str,
+    game: Optional[str] = None,
+    timings: bool = False,
+    token_data: dict = Depends(verify_token)
+) -> StreamingResponse:
+    """Answer a question as Server-Sent Events: context references first, then tokens."""
+    if not question:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No question provided.")
+    rag_service: RAGService = ready_rag_service()
+    record_question(rag_service, question, game)
+    # Hold the slot for the whole stream, released once the response is finished or dropped
+    slot = AsyncExitStack()
+    await slot.enter_async_context(query_limiter.slot())
+
+    async def events():
+        start = time.perf_counter()
+        stage_timings = {} if timings else None
+        metrics.request_timings.set(stage_timings)
+        try:
+            async for event in rag_service.astream_query(question, game=game):
+                if event["event"] == "done" and stage_timings is not None:
+                    event["data"]["timings"] = _timings_ms(stage_timings, start)
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        except GenerationRejected as e:
+            # The response has started, the rejection travels as an error event
+            metrics.QUERIES.inc(mode="stream", status="rejected")
+            yield f"event: error\ndata: {json.dumps({'detail': e.detail, 'status': e.status_code, 'retry_after': e.retry_after})}\n\n"
+        except UnknownGame as e:
+            metrics.QUERIES.inc(mode="stream", status="unknown_game")
+            yield f"event: error\ndata: {json.dumps({'detail': e.detail, 'status': e.status_code})}\n\n"
+        except Exception as e:
+            metrics.QUERIES.inc(mode="stream", status="error")
+            print(f"Error in query_stream: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': 'Failed to answer the question.'})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(slot.aclose))
+
+
+@app.post("/query/batch")
+async def query_batch_api(
+    batch: BatchQueryRequest,
+    token_data: dict = Depends(verify_token)
+):
+    """
+    Answer several questions in one request. The questions are embedded together and answered
+    with bounded concurrency, results come back in order, or as NDJSON lines in completion order with stream=true.
+    """
+    if not batch.questions:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No questions provided.")
+    if len(batch.questions) > max_batch_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {max_batch_size} questions per batch.")
+    rag_service: RAGService = ready_rag_service()
+    items = [(item.question, item.game or batch.game) for item in batch.questions]
+    # Hold the slot for the whole batch, released once the response is finished or dropped
+    slot = AsyncExitStack()
+    await slot.enter_async_context(query_limiter.slot())
+
+    if not batch.stream:
+        async with slot:
+            results = {
+                index: _batch_result(items, index, answer, rejection)
+                async for index, answer, rejection in rag_service.abatch_query(items, concurrency=batch_concurrency)}
+        return {"results": [results[index] for index in range(len(items))]}
+
+    async def lines():
+        try:
+            async for index, answer, rejection in rag_service.abatch_query(items, concurrency=batch_concurrency):
+                yield json.dumps(_batch_result(items, index, answer, rejection)) + "\n"
+        except Exception as e:
+            print(f"Error in query_batch: {e}")
+            yield json.dumps({"error": "Failed to answer the batch."}) + "\n"
 
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(slot.aclose))
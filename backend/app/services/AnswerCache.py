@@ -0,0 +1,111 @@
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from app.services.CacheBackend import CacheBackend
+
+
+@dataclass
+class CachedAnswer:
+  answer: str
+  references: List[dict]
+  embedding: np.ndarray
+
+
+class AnswerCache:
+  """
+  Two-tier answer cache in front of the generator.
+  Tier one matches the normalized question text exactly, tier two reuses the answer
+  of a cached question whose embedding is within `similarity_threshold` (cosine).
+  Entries live in the given CacheBackend, which handles LRU eviction, and expire after `ttl_seconds`.
+  Each answer is stored with its embedding as the entry's vector (raw float32 bytes), so a semantic
+  lookup scans only the vectors instead of unpickling every cached answer, and both are evicted together.
+  """
+  def __init__(self, backend: CacheBackend, ttl_seconds: float = 3600, similarity_threshold: float = 0.95):
+    self.backend = backend
+    self.ttl_seconds = ttl_seconds
+    self.similarity_threshold = similarity_threshold
+    self.index_version: Optional[str] = None
+    self.exact_hits = 0
+    self.semantic_hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def normalize(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+  @classmethod
+  def key(cls, question: str, scope: Optional[str] = None) -> str:
+    # Scope (e.g. the game) prefixes the key, answers never leak across games
+    return f"{scope or ''}\x1f{cls.normalize(question)}"
+
+  @property
+  def namespace(self) -> str:
+    # Answers are only valid for the index they were generated from
+    return f"answers:{self.index_version}"
+
+  def set_index_version(self, index_version: Optional[str]) -> None:
+    if index_version != self.index_version:
+      self.clear()
+      self.index_version = index_version
+
+  def get_exact(self, question: str, scope: Optional[str] = None) -> Optional[CachedAnswer]:
+    entry = self.backend.get(self.namespace, self.key(question, scope))
+    if entry is not None:
+      self._count("exact_hits")
+    return entry
+
+  def peek(self, question: str, scope: Optional[str] = None) -> Optional[CachedAnswer]:
+    """Like get_exact() without counting a hit, for warm-up bookkeeping."""
+    return self.backend.get(self.namespace, self.key(question, scope))
+
+  def get_semantic(self, embedding: List[float], scope: Optional[str] = None) -> Optional[CachedAnswer]:
+    prefix = self.key("", scope)
+    entries = [(key, vector) for key, vector in self.backend.vectors(self.namespace) if key.startswith(prefix)]
+    if entries:
+      similarities = np.stack([np.frombuffer(vector, dtype=np.float32) for _, vector in entries]) @ self._unit(embedding)
+      best = int(np.argmax(similarities))
+      if similarities[best] >= self.similarity_threshold:
+        # Re-read through get() so the hit counts as a use for LRU eviction
+        entry = self.backend.get(self.namespace, entries[best][0])
+        if entry is not None:
+          self._count("semantic_hits")
+          return entry
+    self._count("misses")
+    return None
+
+  def put(
+    self, question: str, embedding: List[float], answer: str, references: List[dict], scope: Optional[str] = None
+  ) -> None:
+    if answer is None:
+      return
+    entry = CachedAnswer(answer=answer, references=references, embedding=self._unit(embedding))
+    self.backend.set(
+      self.namespace, self.key(question, scope), entry, ttl_seconds=self.ttl_seconds, vector=entry.embedding.tobytes())
+
+  def clear(self) -> None:
+    self.backend.clear(self.namespace)
+
+  def stats(self) -> dict:
+    # A COUNT(*) with the SQLite backend, outside the lock
+    entries = self.backend.count(self.namespace)
+    with self._lock:
+      return {
+        "entries": entries,
+        "exact_hits": self.exact_hits,
+        "semantic_hits": self.semantic_hits,
+        "misses": self.misses,
+      }
+
+  def _count(self, counter: str) -> None:
+    with self._lock:
+      setattr(self, counter, getattr(self, counter) + 1)
+
+  @staticmethod
+  def _unit(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,98 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+from neo4j_haystack.client.neo4j_client import Neo4jClient, Neo4jClientConfig
+from ollama import Client
+
+
+class BackendClients:
+  """
+  Connection pools to Neo4j and Ollama, shared by every component of a RAGService.
+
+  Haystack components each open their own clients, so the embedders, the generator and the
+  document store would all keep separate pools with default settings (httpx drops idle
+  connections after 5s). Here there is one Neo4j driver and one keep-alive HTTP pool per Ollama
+  server, sized and timed out from the environment, closed together by RAGService.close().
+  """
+  def __init__(self):
+    self.ollama_pool_size = int(os.getenv("OLLAMA_POOL_SIZE", "16"))
+    self._ollama: Dict[str, Client] = {}
+    self._ollama_lock = threading.Lock()
+    self.ollama = self.ollama_for(os.getenv("OLLAMA_BASE_URL"))
+    self._neo4j: Optional[Neo4jClient] = None
+    self._neo4j_lock = threading.Lock()
+
+  def ollama_for(self, url: str) -> Client:
+    """The pooled client of one Ollama server, generation can spread over several (see GenerationScheduler)."""
+    with self._ollama_lock:
+      if url not in self._ollama:
+        self._ollama[url] = Client(
+          host=url,
+          timeout=httpx.Timeout(
+            float(os.getenv("OLLAMA_TIMEOUT", "120")),
+            connect=float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))),
+          limits=httpx.Limits(
+            max_connections=self.ollama_pool_size,
+            max_keepalive_connections=self.ollama_pool_size,
+            keepalive_expiry=float(os.getenv("OLLAMA_KEEPALIVE_SECONDS", "60"))))
+      return self._ollama[url]
+
+  @property
+  def neo4j(self) -> Neo4jClient:
+    """The Neo4j driver, created on first use so a stand-in document store never opens one."""
+    with self._neo4j_lock:
+      if self._neo4j is None:
+        self._neo4j = Neo4jClient(Neo4jClientConfig(
+          url=os.getenv("NEO4J_URI"),
+          database=os.getenv("NEO4J_DATABASE"),
+          username=os.getenv("NEO4J_USERNAME"),
+          password=os.getenv("NEO4J_PASSWORD"),
+          driver_config={
+            "max_connection_pool_size": int(os.getenv("NEO4J_POOL_SIZE", "16")),
+            "connection_acquisition_timeout": float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "10")),
+            "connection_timeout": float(os.getenv("NEO4J_CONNECT_TIMEOUT", "5")),
+            "max_connection_lifetime": float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600")),
+            # Pooled connections idle for longer are pinged before reuse instead of failing a query
+            "liveness_check_timeout": float(os.getenv("NEO4J_LIVENESS_CHECK_SECONDS", "30")),
+            "keep_alive": True,
+          }))
+      return self._neo4j
+
+  def share_with(self, component: Any) -> Any:
+    """Points an Ollama component (embedder or generator) at the shared pool of its url instead of its own client."""
+    shared = self.ollama_for(component.url)
+    own_client = getattr(component, "_client", None)
+    if own_client is not None and own_client is not shared:
+      own_client._client.close()
+    component._client = shared
+    return component
+
+  def health(self) -> Dict[str, Dict[str, Any]]:
+    """Round trip to each backend, for /health/ready?check=true."""
+    checks: Dict[str, Dict[str, Any]] = {}
+    with self._ollama_lock:
+      ollama = dict(self._ollama)
+    for url, client in ollama.items():
+      name = "ollama" if client is self.ollama else f"ollama {url}"
+      try:
+        checks[name] = {"ok": True, "loaded_models": [model.model for model in client.ps().models]}
+      except Exception as e:
+        checks[name] = {"ok": False, "error": str(e)}
+    if self._neo4j is not None:
+      try:
+        self._neo4j.verify_connectivity()
+        checks["neo4j"] = {"ok": True}
+      except Exception as e:
+        checks["neo4j"] = {"ok": False, "error": str(e)}
+    return checks
+
+  def close(self) -> None:
+    with self._ollama_lock:
+      for client in self._ollama.values():
+        client._client.close()
+    with self._neo4j_lock:
+      if self._neo4j is not None:
+        self._neo4j.close_driver()
+        self._neo4j = None
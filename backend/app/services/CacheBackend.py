@@ -0,0 +1,215 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+DEFAULT_SQLITE_PATH = Path(__file__).parent.parent.parent / "data" / "cache.sqlite3"
+
+
+class CacheBackend(ABC):
+  """
+  Key/value store behind the embedding and answer caches.
+  Keys live in namespaces, each capped at `max_entries` with least-recently-used eviction.
+  An entry may carry a vector next to its value, scanned by vectors() without loading the values.
+  """
+  # Whether every worker on the host sees the same entries
+  shared = False
+
+  def __init__(self, max_entries: int = 512):
+    self.max_entries = max_entries
+
+  @abstractmethod
+  def get(self, namespace: str, key: str) -> Optional[Any]:
+    """Returns the live value for key and marks it as recently used."""
+
+  @abstractmethod
+  def set(
+    self, namespace: str, key: str, value: Any, ttl_seconds: Optional[float] = None, vector: Optional[bytes] = None
+  ) -> None:
+    """Stores a value (and its vector), evicting the least recently used entries past max_entries."""
+
+  @abstractmethod
+  def items(self, namespace: str) -> List[Tuple[str, Any]]:
+    """All live entries of a namespace, without touching their recency."""
+
+  @abstractmethod
+  def vectors(self, namespace: str) -> List[Tuple[str, bytes]]:
+    """(key, vector) of the live entries stored with a vector, without loading their values or touching their recency."""
+
+  @abstractmethod
+  def clear(self, namespace: str) -> None:
+    """Drops every entry of a namespace."""
+
+  def count(self, namespace: str) -> int:
+    """Number of live entries of a namespace."""
+    return len(self.items(namespace))
+
+  def close(self) -> None:
+    pass
+
+
+class InMemoryCacheBackend(CacheBackend):
+  """Per-process cache, each uvicorn worker holds its own copy."""
+  def __init__(self, max_entries: int = 512):
+    super().__init__(max_entries)
+    self._namespaces: dict[str, "OrderedDict[str, Tuple[Any, float, Optional[bytes]]]"] = {}
+    self._lock = threading.Lock()
+
+  def get(self, namespace: str, key: str) -> Optional[Any]:
+    with self._lock:
+      entries = self._namespaces.get(namespace, {})
+      entry = entries.get(key)
+      if entry is None:
+        return None
+      value, expires_at, _ = entry
+      if expires_at < time.time():
+        del entries[key]
+        return None
+      entries.move_to_end(key)
+      return value
+
+  def set(
+    self, namespace: str, key: str, value: Any, ttl_seconds: Optional[float] = None, vector: Optional[bytes] = None
+  ) -> None:
+    if self.max_entries <= 0:
+      return
+    expires_at = time.time() + ttl_seconds if ttl_seconds else float("inf")
+    with self._lock:
+      entries = self._namespaces.setdefault(namespace, OrderedDict())
+      entries[key] = (value, expires_at, vector)
+      entries.move_to_end(key)
+      while len(entries) > self.max_entries:
+        entries.popitem(last=False)
+
+  def items(self, namespace: str) -> List[Tuple[str, Any]]:
+    with self._lock:
+      return [(key, value) for key, (value, _, _) in self._live(namespace).items()]
+
+  def vectors(self, namespace: str) -> List[Tuple[str, bytes]]:
+    with self._lock:
+      return [(key, vector) for key, (_, _, vector) in self._live(namespace).items() if vector is not None]
+
+  def _live(self, namespace: str) -> "OrderedDict[str, Tuple[Any, float, Optional[bytes]]]":
+    """Entries of a namespace after dropping the expired ones, called with the lock held."""
+    now = time.time()
+    entries = self._namespaces.get(namespace, OrderedDict())
+    for key in [key for key, (_, expires_at, _) in entries.items() if expires_at < now]:
+      del entries[key]
+    return entries
+
+  def clear(self, namespace: str) -> None:
+    with self._lock:
+      self._namespaces.pop(namespace, None)
+
+
+class SQLiteCacheBackend(CacheBackend):
+  """
+  Cache shared by every worker on the host through a SQLite file in WAL mode,
+  so the hit rate grows with total traffic instead of being split per worker.
+  """
+  shared = True
+
+  def __init__(self, path: Optional[str] = None, max_entries: int = 512):
+    super().__init__(max_entries)
+    self.path = Path(path or DEFAULT_SQLITE_PATH)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self._local = threading.local()
+    with self._connection() as connection:
+      connection.execute("""
+        CREATE TABLE IF NOT EXISTS cache (
+          namespace TEXT NOT NULL,
+          key TEXT NOT NULL,
+          value BLOB NOT NULL,
+          expires_at REAL NOT NULL,
+          accessed_at REAL NOT NULL,
+          vector BLOB,
+          PRIMARY KEY (namespace, key))
+      """)
+      columns = [row[1] for row in connection.execute("PRAGMA table_info(cache)")]
+      if "vector" not in columns:
+        # Cache files created before entries had vectors
+        connection.execute("ALTER TABLE cache ADD COLUMN vector BLOB")
+
+  def _connection(self) -> sqlite3.Connection:
+    # sqlite3 connections can't be shared across threads, keep one per executor thread
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.path, timeout=5)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      self._local.connection = connection
+    return connection
+
+  def get(self, namespace: str, key: str) -> Optional[Any]:
+    now = time.time()
+    with self._connection() as connection:
+      row = connection.execute(
+        "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at >= ?",
+        (namespace, key, now)).fetchone()
+      if row is None:
+        return None
+      connection.execute(
+        "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+    return pickle.loads(row[0])
+
+  def set(
+    self, namespace: str, key: str, value: Any, ttl_seconds: Optional[float] = None, vector: Optional[bytes] = None
+  ) -> None:
+    if self.max_entries <= 0:
+      return
+    now = time.time()
+    expires_at = now + ttl_seconds if ttl_seconds else float("inf")
+    with self._connection() as connection:
+      connection.execute(
+        "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at, vector) VALUES (?, ?, ?, ?, ?, ?)",
+        (namespace, key, pickle.dumps(value), expires_at, now, vector))
+      connection.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+      connection.execute("""
+        DELETE FROM cache WHERE namespace = ? AND key IN (
+          SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)
+      """, (namespace, namespace, self.max_entries))
+
+  def items(self, namespace: str) -> List[Tuple[str, Any]]:
+    with self._connection() as connection:
+      rows = connection.execute(
+        "SELECT key, value FROM cache WHERE namespace = ? AND expires_at >= ?",
+        (namespace, time.time())).fetchall()
+    return [(key, pickle.loads(value)) for key, value in rows]
+
+  def vectors(self, namespace: str) -> List[Tuple[str, bytes]]:
+    with self._connection() as connection:
+      return connection.execute(
+        "SELECT key, vector FROM cache WHERE namespace = ? AND expires_at >= ? AND vector IS NOT NULL",
+        (namespace, time.time())).fetchall()
+
+  def count(self, namespace: str) -> int:
+    with self._connection() as connection:
+      return connection.execute(
+        "SELECT COUNT(*) FROM cache WHERE namespace = ? AND expires_at >= ?",
+        (namespace, time.time())).fetchone()[0]
+
+  def clear(self, namespace: str) -> None:
+    with self._connection() as connection:
+      connection.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+  def close(self) -> None:
+    connection = getattr(self._local, "connection", None)
+    if connection is not None:
+      connection.close()
+      self._local.connection = None
+
+
+def create_cache_backend() -> CacheBackend:
+  """Picks the backend from CACHE_BACKEND ("memory" or "sqlite"), no code changes needed to swap."""
+  backend = os.getenv("CACHE_BACKEND", "memory").lower()
+  max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+  if backend == "sqlite":
+    return SQLiteCacheBackend(path=os.getenv("CACHE_SQLITE_PATH"), max_entries=max_entries)
+  if backend == "memory":
+    return InMemoryCacheBackend(max_entries=max_entries)
+  raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
@@ -0,0 +1,113 @@
+import re
+from typing import List, Optional, Set, Tuple
+
+from haystack import Document, component
+
+
+@component
+class ContextAssembler:
+  """
+  Shapes the retrieved chunks into the context put in the prompt, generation time grows with its length.
+  Drops near-duplicate chunks, keeps the most relevant chunks that fit in `token_budget`,
+  merges the kept chunks that were adjacent in the source back into one and collapses whitespace.
+  Tokens are estimated at `chars_per_token` characters each, no tokenizer round trip.
+  """
+  def __init__(self, token_budget: int = 2048, duplicate_threshold: float = 0.9, chars_per_token: float = 4.0):
+    self.token_budget = token_budget
+    self.duplicate_threshold = duplicate_threshold
+    self.chars_per_token = chars_per_token
+
+  @component.output_types(documents=List[Document])
+  def run(self, documents: List[Document], token_budget: Optional[int] = None):
+    token_budget = token_budget or self.token_budget
+    ranked = sorted(documents, key=lambda document: document.score or 0.0, reverse=True)
+    ranked = self._drop_near_duplicates(ranked)
+
+    # The budget applies chunk by chunk, a merged chunk cut to size could lose the part that matched
+    selected: List[Document] = []
+    used = 0
+    for document in ranked:
+      tokens = self.estimate_tokens(self.compact(document.content or ""))
+      if used + tokens > token_budget:
+        if selected:
+          continue
+        # The best chunk alone is over budget, keep its head rather than nothing
+        content = self.compact(document.content or "")[:int(token_budget * self.chars_per_token)]
+        document = Document(id=document.id, content=content, meta=document.meta, score=document.score)
+        tokens = token_budget
+      selected.append(document)
+      used += tokens
+    merged = self._merge_adjacent(selected)
+    return {"documents": [
+      Document(id=document.id, content=self.compact(document.content or ""), meta=document.meta, score=document.score)
+      for document in merged]}
+
+  def estimate_tokens(self, text: str) -> int:
+    return int(len(text) / self.chars_per_token) + 1
+
+  @staticmethod
+  def compact(text: str) -> str:
+    """Collapses runs of spaces and blank lines, they cost tokens and carry nothing."""
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+  def _drop_near_duplicates(self, ranked: List[Document]) -> List[Document]:
+    kept: List[Tuple[Document, Set[Tuple[str, ...]]]] = []
+    for document in ranked:
+      shingles = _shingles(document.content or "")
+      if not any(_jaccard(shingles, other) >= self.duplicate_threshold for _, other in kept):
+        kept.append((document, shingles))
+    return [document for document, _ in kept]
+
+  @staticmethod
+  def _merge_adjacent(ranked: List[Document]) -> List[Document]:
+    """
+    Chunks that follow each other in the same source document are merged in reading order,
+    the merged chunk takes the place and score of its best part.
+    """
+    by_position = {
+      (document.meta.get("source_id"), document.meta.get("split_id")): document
+      for document in ranked if document.meta.get("source_id") is not None and document.meta.get("split_id") is not None
+    }
+    merged: List[Document] = []
+    absorbed: Set[str] = set()
+    for document in ranked:
+      if document.id in absorbed:
+        continue
+      source_id, split_id = document.meta.get("source_id"), document.meta.get("split_id")
+      if source_id is None or split_id is None:
+        merged.append(document)
+        continue
+      first = last = split_id
+      while (source_id, first - 1) in by_position and by_position[(source_id, first - 1)].id not in absorbed:
+        first -= 1
+      while (source_id, last + 1) in by_position and by_position[(source_id, last + 1)].id not in absorbed:
+        last += 1
+      if first == last:
+        merged.append(document)
+        continue
+      parts = [by_position[(source_id, i)] for i in range(first, last + 1)]
+      absorbed.update(part.id for part in parts)
+      content = ""
+      for part in parts:
+        # Word splits are consecutive slices of the source and join back seamlessly,
+        # markdown sections are separate blocks
+        if content and not content[-1].isspace():
+          content += "\n\n"
+        content += part.content or ""
+      merged.append(Document(
+        id=document.id,
+        content=content,
+        meta={**parts[0].meta, "merged_ids": [part.id for part in parts]},
+        score=document.score))
+    return merged
+
+
+def _shingles(text: str, n: int = 3) -> Set[Tuple[str, ...]]:
+  words = re.findall(r"\w+", text.lower())
+  return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def _jaccard(a: Set[Tuple[str, ...]], b: Set[Tuple[str, ...]]) -> float:
+  return len(a & b) / len(a | b) if a or b else 1.0
@@ -0,0 +1,68 @@
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Optional file in a corpus directory describing each document, e.g.
+# [{"path": "drg/DRG_2E_Rulebook_docling.md", "game": "drg", "edition": "2e", "section": "rulebook"}]
+CORPUS_MANIFEST = "corpus.json"
+# Metadata fields that namespace a chunk, the same text in two games is two different chunks
+CORPUS_META_FIELDS = ("game", "edition", "section")
+# The PDF parsers separate pages with form feeds, see app.utils.PDFParser
+PAGE_BREAK = "\f"
+
+
+class UnknownGame(LookupError):
+  """Nothing is indexed for the requested game, answered with a 404 rather than a guess without context."""
+  status_code = 404
+
+  def __init__(self, game: str):
+    super().__init__(f"Unknown game: {game}")
+    self.game = game
+    self.detail = f"No rules are indexed for game {game!r}"
+
+
+@dataclass
+class CorpusDocument:
+  path: str
+  meta: dict = field(default_factory=dict)
+
+
+def corpus_scope(meta: dict) -> str:
+  """Corpus namespace of a document or chunk, e.g. "drg/2e/rulebook"."""
+  return "/".join(str(meta[key]) for key in CORPUS_META_FIELDS if meta.get(key))
+
+
+def split_pages(text: str) -> List[Tuple[Optional[int], str]]:
+  """(page number, text) of each non-blank page, 1-based. A document without page breaks is one page numbered None."""
+  if PAGE_BREAK not in text:
+    return [(None, text)]
+  return [(page, content) for page, content in enumerate(text.split(PAGE_BREAK), start=1) if content.strip()]
+
+
+def load_corpus(source: str) -> List[CorpusDocument]:
+  """
+  Resolves what to index from a single markdown file or a corpus directory.
+  A directory is described by its corpus.json, without one every markdown file
+  under it is indexed and its game is the first sub-directory (or the file name).
+  """
+  path = Path(source)
+  if path.is_file():
+    return [CorpusDocument(path=str(path))]
+
+  manifest = path / CORPUS_MANIFEST
+  if manifest.exists():
+    with open(manifest, "r", encoding="utf-8") as f:
+      entries = json.load(f)
+    return [
+      CorpusDocument(
+        path=str(path / entry["path"]),
+        meta={key: entry[key] for key in CORPUS_META_FIELDS if key in entry})
+      for entry in entries
+    ]
+
+  documents = []
+  for markdown in sorted(path.glob("**/*.md")):
+    parts = markdown.relative_to(path).parts
+    documents.append(CorpusDocument(path=str(markdown), meta={"game": parts[0] if len(parts) > 1 else markdown.stem}))
+  return documents
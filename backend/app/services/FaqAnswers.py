@@ -0,0 +1,54 @@
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional
+
+DEFAULT_FAQ_DIR = Path(__file__).parent.parent.parent / "data" / "faq_answers"
+
+
+@dataclass
+class FaqAnswer:
+  question: str
+  game: Optional[str]
+  answer: str
+  references: List[dict]
+  embedding: List[float]
+
+
+class FaqAnswers:
+  """
+  Answers precomputed for the most asked questions, one JSON file per index version
+  so a restart on the same index loads them into the answer cache without generating.
+  Only the `keep` most recent index versions are kept on disk.
+  """
+  def __init__(self, index_version: Optional[str], directory: Optional[str] = None, keep: int = 3):
+    self.directory = Path(directory or os.getenv("FAQ_ANSWERS_DIR") or DEFAULT_FAQ_DIR)
+    self.path = self.directory / f"{index_version}.json"
+    # Held by the worker precomputing answers for this index version, see RAGService.precompute_faq
+    self.lock_path = self.path.with_suffix(".lock")
+    self.keep = keep
+
+  def load(self, generative_model: Optional[str]) -> List[FaqAnswer]:
+    """Stored answers, none when they were generated by another model."""
+    if not self.path.exists():
+      return []
+    with open(self.path, "r", encoding="utf-8") as f:
+      data = json.load(f)
+    if data.get("generative_model") != generative_model:
+      return []
+    return [FaqAnswer(**answer) for answer in data.get("answers", [])]
+
+  def save(self, answers: List[FaqAnswer], generative_model: Optional[str]) -> None:
+    self.directory.mkdir(parents=True, exist_ok=True)
+    tmp_path = self.path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      json.dump({
+        "generative_model": generative_model,
+        "answers": [asdict(answer) for answer in answers],
+      }, f)
+    os.replace(tmp_path, self.path)
+    stored = sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in stored[self.keep:]:
+      path.unlink(missing_ok=True)
+      path.with_suffix(".lock").unlink(missing_ok=True)
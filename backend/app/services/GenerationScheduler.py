@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Deque, Iterator, List, Optional
+
+import httpx
+
+from app.utils import metrics
+
+# Nothing was generated when these are raised, the request can go to another backend.
+# Only these put a backend in cooldown, a read timeout is a slow generation, not a dead server
+UNREACHABLE = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class GenerationRejected(Exception):
+  """No generation backend could take the request: queue full (429) or deadline passed (503)."""
+  def __init__(self, status_code: int, detail: str, retry_after: int = 1):
+    super().__init__(detail)
+    self.status_code = status_code
+    self.detail = detail
+    self.retry_after = retry_after
+
+
+@dataclass
+class GenerationBackend:
+  url: str
+  generator: Any
+  max_in_flight: int
+  in_flight: int = 0
+  dispatched: int = 0
+  # Set after a connection failure, the backend gets no requests until then
+  down_until: float = 0.0
+
+
+class GenerationScheduler:
+  """
+  Routes each generation to the least loaded Ollama backend, at most `max_in_flight` per backend.
+  When all are busy, requests wait in FIFO order for up to `queue_timeout` seconds and are then
+  rejected with a 503. More than `max_queued` waiting are rejected at once with a 429.
+  A backend that can't be connected to is skipped for `cooldown` seconds.
+  Called from the executor threads, limits apply per worker process.
+  """
+  def __init__(
+    self,
+    backends: List[GenerationBackend],
+    max_queued: int = 16,
+    queue_timeout: float = 30.0,
+    cooldown: float = 10.0
+  ):
+    self.backends = backends
+    self.max_queued = max_queued
+    self.queue_timeout = queue_timeout
+    self.cooldown = cooldown
+    self._waiting: Deque[object] = deque()
+    self._condition = threading.Condition()
+    metrics.REGISTRY.register(metrics.Gauge(
+      "rag_generation_in_flight", "Generations running per Ollama backend, over all workers.",
+      callback=lambda: {(backend.url,): backend.in_flight for backend in self.backends}, labelnames=("backend",)))
+    metrics.REGISTRY.register(metrics.Gauge(
+      "rag_generation_queued", "Generations waiting for a backend, over all workers.",
+      callback=lambda: {(): len(self._waiting)}))
+
+  @contextmanager
+  def slot(self, timeout: Optional[float] = None) -> Iterator[GenerationBackend]:
+    backend = self._acquire(self.queue_timeout if timeout is None else timeout)
+    try:
+      yield backend
+    except UNREACHABLE:
+      with self._condition:
+        backend.down_until = time.monotonic() + self.cooldown
+      print(f"Generation backend {backend.url} failed, skipping it for {self.cooldown:.0f}s")
+      raise
+    finally:
+      with self._condition:
+        backend.in_flight -= 1
+        self._condition.notify_all()
+
+  def _acquire(self, timeout: float) -> GenerationBackend:
+    deadline = time.monotonic() + timeout
+    with self._condition:
+      backend = None if self._waiting else self._least_loaded()
+      if backend is None:
+        if len(self._waiting) >= self.max_queued:
+          metrics.GENERATION_REJECTED.inc(reason="queue_full")
+          raise GenerationRejected(429, "All generation backends are busy, please retry shortly")
+        ticket = object()
+        self._waiting.append(ticket)
+        try:
+          while True:
+            # First in line takes the next free backend
+            if self._waiting[0] is ticket and (backend := self._least_loaded()) is not None:
+              break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+              metrics.GENERATION_REJECTED.inc(reason="deadline")
+              raise GenerationRejected(
+                503, f"No generation backend available within {timeout:g}s", retry_after=max(1, int(timeout)))
+            self._condition.wait(min(remaining, self.cooldown))
+        finally:
+          self._waiting.remove(ticket)
+          self._condition.notify_all()
+      backend.in_flight += 1
+      backend.dispatched += 1
+      return backend
+
+  def _least_loaded(self) -> Optional[GenerationBackend]:
+    now = time.monotonic()
+    available = [
+      backend for backend in self.backends
+      if backend.in_flight < backend.max_in_flight and backend.down_until <= now]
+    if not available:
+      return None
+    # Lowest share of its limit in use, ties go to the backend that got fewer requests so far
+    return min(available, key=lambda backend: (backend.in_flight / backend.max_in_flight, backend.dispatched))
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Set
+
+DEFAULT_MANIFEST_PATH = Path(__file__).parent.parent.parent / "data" / "index_manifest.json"
+
+
+def chunk_hash(content: str, scope: str = "") -> str:
+  """Content address of a chunk within its corpus scope (game/edition/section), used as its document id in Neo4j."""
+  if scope:
+    content = f"{scope}\x00{content}"
+  return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+  """
+  Record of which chunk hashes are stored in the Neo4j vector index.
+  Lets build_embeddings only embed chunks that are new or changed.
+  """
+  def __init__(self, path: Optional[str] = None):
+    self.path = Path(path or os.getenv("INDEX_MANIFEST_PATH") or DEFAULT_MANIFEST_PATH)
+    self.embedding_model: Optional[str] = None
+    self.hashes: Set[str] = set()
+
+  def load(self) -> "IndexManifest":
+    if self.path.exists():
+      with open(self.path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+      self.embedding_model = data.get("embedding_model")
+      self.hashes = set(data.get("hashes", []))
+    return self
+
+  def save(self) -> None:
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = self.path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      json.dump({
+        "version": self.version,
+        "embedding_model": self.embedding_model,
+        "hashes": sorted(self.hashes),
+      }, f)
+    os.replace(tmp_path, self.path)
+
+  def reset(self, hashes: Iterable[str] = (), embedding_model: Optional[str] = None) -> None:
+    self.hashes = set(hashes)
+    self.embedding_model = embedding_model
+
+  @property
+  def version(self) -> str:
+    """Identifies the exact set of chunks (and embedding model) in the index."""
+    digest = hashlib.sha256((self.embedding_model or "").encode("utf-8"))
+    for h in sorted(self.hashes):
+      digest.update(h.encode("utf-8"))
+    return digest.hexdigest()[:16]
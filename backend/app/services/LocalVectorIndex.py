@@ -0,0 +1,130 @@
+import fcntl
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from haystack import Document, component
+from haystack.utils.filters import document_matches_filter
+
+DEFAULT_INDEX_DIR = Path(__file__).parent.parent.parent / "data" / "vector_index"
+
+
+class LocalVectorIndex:
+  """
+  In-process copy of the chunk embeddings stored in Neo4j.
+  Vectors are unit-normalized float32 rows in a memory-mapped .npy file, so every
+  worker on the host shares one copy through the page cache and a top-k query is
+  a single matrix-vector product. Neo4j stays the source of truth.
+  """
+  # Exports of this many index versions are kept, for workers still attaching to an older one
+  KEEP_VERSIONS = 3
+
+  def __init__(self, vectors: np.ndarray, documents: List[Document]):
+    self.vectors = vectors
+    self.documents = documents
+    # The only filter the API sends is a game, one mask per game of the corpus
+    games: Dict[Any, List[int]] = {}
+    for i, document in enumerate(documents):
+      games.setdefault(document.meta.get("game"), []).append(i)
+    self._game_masks: Dict[Any, np.ndarray] = {}
+    for game, rows in games.items():
+      mask = np.zeros(len(documents), dtype=bool)
+      mask[rows] = True
+      self._game_masks[game] = mask
+
+  @classmethod
+  def load_or_export(cls, document_store, index_version: Optional[str], directory: Optional[str] = None) -> "LocalVectorIndex":
+    """Loads the export for this index version, exporting it from the document store first if needed."""
+    directory = Path(directory or os.getenv("LOCAL_VECTOR_INDEX_DIR") or DEFAULT_INDEX_DIR)
+    vectors_path = directory / f"vectors-{index_version}.npy"
+    documents_path = directory / f"documents-{index_version}.json"
+    directory.mkdir(parents=True, exist_ok=True)
+    # Held from the existence check until the files are open, another worker's export prunes old versions
+    with open(directory / "export.lock", "w") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        if not (vectors_path.exists() and documents_path.exists()):
+          cls.export(document_store, vectors_path, documents_path)
+        with open(documents_path, "r", encoding="utf-8") as f:
+          documents = [Document(id=record["id"], content=record["content"], meta=record["meta"]) for record in json.load(f)]
+        vectors = np.load(vectors_path, mmap_mode="r")
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return cls(vectors, documents)
+
+  @classmethod
+  def export(cls, document_store, vectors_path: Path, documents_path: Path) -> None:
+    """Writes the export, callers hold the export lock (see load_or_export)."""
+    documents = [
+      document for document in document_store.get_all_documents_generator(return_embedding=True)
+      if document.embedding is not None
+    ]
+    vectors = np.asarray([document.embedding for document in documents], dtype=np.float32)
+    if len(vectors):
+      norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+      vectors /= np.where(norms == 0, 1, norms)
+
+    vectors_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write under a per-process name and rename, a crashed export leaves no partial file behind
+    suffix = f".{os.getpid()}.tmp"
+    with open(str(vectors_path) + suffix, "wb") as f:
+      np.save(f, vectors)
+    with open(str(documents_path) + suffix, "w", encoding="utf-8") as f:
+      json.dump([
+        {"id": document.id, "content": document.content, "meta": document.meta}
+        for document in documents
+      ], f)
+    os.replace(str(documents_path) + suffix, documents_path)
+    os.replace(str(vectors_path) + suffix, vectors_path)
+    # Drop the oldest exports, processes still mapping them keep their copy until they exit
+    exported = sorted(vectors_path.parent.glob("vectors-*.npy"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for stale in exported[cls.KEEP_VERSIONS:]:
+      stale.unlink(missing_ok=True)
+      (stale.parent / f"documents-{stale.stem[len('vectors-'):]}.json").unlink(missing_ok=True)
+    print(f"Exported {len(documents)} embeddings to {vectors_path}")
+
+  def query(self, query_embedding: List[float], top_k: int = 10, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+    if not self.documents:
+      return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1)
+    similarities = self.vectors @ query
+    if filters:
+      similarities = np.where(self._mask(filters), similarities, -np.inf)
+    top_k = min(top_k, len(self.documents))
+    candidates = np.argpartition(-similarities, top_k - 1)[:top_k]
+    ranked = candidates[np.argsort(-similarities[candidates])]
+    return [
+      # Same scale as the Neo4j vector search with scale_score=True
+      Document(
+        id=self.documents[i].id,
+        content=self.documents[i].content,
+        meta=self.documents[i].meta,
+        score=float((similarities[i] + 1) / 2))
+      for i in ranked if similarities[i] != -np.inf
+    ]
+
+  def _mask(self, filters: Dict[str, Any]) -> np.ndarray:
+    if filters.get("field") == "meta.game" and filters.get("operator") == "==":
+      # Precomputed, an unknown game matches nothing and isn't cached
+      mask = self._game_masks.get(filters.get("value"))
+      return mask if mask is not None else np.zeros(len(self.documents), dtype=bool)
+    return np.array([document_matches_filter(filters, document) for document in self.documents])
+
+
+@component
+class LocalEmbeddingRetriever:
+  """Drop-in replacement for the Neo4j retriever backed by a LocalVectorIndex."""
+  def __init__(self, vector_index: LocalVectorIndex, filters: Optional[Dict[str, Any]] = None, top_k: int = 10):
+    self.vector_index = vector_index
+    self.filters = filters
+    self.top_k = top_k
+
+  @component.output_types(documents=List[Document])
+  def run(self, query_embedding: List[float], filters: Optional[Dict[str, Any]] = None, top_k: Optional[int] = None):
+    return {"documents": self.vector_index.query(
+      query_embedding,
+      top_k=top_k or self.top_k,
+      filters=filters or self.filters)}
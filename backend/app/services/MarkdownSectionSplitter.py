@@ -0,0 +1,148 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from haystack import Document, component
+
+from app.services.Corpus import split_pages
+
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE = re.compile(r"^\s*(```|~~~)")
+# Docling embeds page images and figures as base64 data URIs, keep only their alt text
+EMBEDDED_IMAGE = re.compile(r"!\[([^\]]*)\]\(data:[^)]*\)")
+
+
+@dataclass
+class _Section:
+  path: List[str]
+  # (page, text) of each block, a block never spans a page break
+  blocks: List[Tuple[Optional[int], str]] = field(default_factory=list)
+
+
+@component
+class MarkdownSectionSplitter:
+  """
+  Splits markdown along its structure instead of every N words.
+  Each `#` section becomes one chunk holding whole paragraphs, lists and tables, with its
+  heading path ("Combat > Attacks") prepended and stored in meta["heading_path"].
+  Sections over `max_words` are cut between blocks and, for a single oversized block, by
+  words (tables by rows, header repeated).
+  Pages separated by form feeds don't end a section, each chunk gets the page it starts on in meta["page"].
+  """
+  def __init__(self, max_words: int = 300):
+    self.max_words = max_words
+
+  @component.output_types(documents=List[Document])
+  def run(self, documents: List[Document]):
+    chunks: List[Document] = []
+    for document in documents:
+      if not document.content:
+        continue
+      texts = self._pack(self._sections(EMBEDDED_IMAGE.sub(r"\1", document.content)))
+      for split_id, (path, page, text) in enumerate(texts):
+        meta = {**document.meta, "source_id": document.id, "split_id": split_id, "heading_path": " > ".join(path)}
+        if page is not None:
+          meta["page"] = page
+        chunks.append(Document(content=text, meta=meta))
+    return {"documents": chunks}
+
+  def _sections(self, markdown: str) -> List[_Section]:
+    """Sections in document order, each body cut into blocks: paragraphs, lists, tables, code."""
+    sections = [_Section(path=[])]
+    levels: List[int] = []
+    block: List[str] = []
+    in_fence = False
+    page: Optional[int] = None
+
+    def end_block():
+      if block:
+        sections[-1].blocks.append((page, "\n".join(block).strip()))
+        block.clear()
+
+    # str.splitlines() also breaks on form feeds, pages are split first
+    lines = [(page_no, line) for page_no, text in split_pages(markdown) for line in text.splitlines()]
+    for page_no, line in lines:
+      if page_no != page:
+        end_block()
+        page = page_no
+      if FENCE.match(line):
+        in_fence = not in_fence
+        block.append(line)
+        continue
+      heading = None if in_fence else HEADING.match(line)
+      if heading:
+        end_block()
+        level = len(heading.group(1))
+        path = sections[-1].path
+        while levels and levels[-1] >= level:
+          levels.pop()
+          path = path[:-1]
+        levels.append(level)
+        sections.append(_Section(path=[*path, heading.group(2)]))
+      elif in_fence:
+        block.append(line)
+      elif not line.strip():
+        end_block()
+      elif block and _is_table_row(line) != _is_table_row(block[-1]):
+        # A table starts or ends without a blank line around it
+        end_block()
+        block.append(line)
+      else:
+        block.append(line)
+    end_block()
+    return [section for section in sections if section.blocks]
+
+  def _pack(self, sections: List[_Section]) -> List[Tuple[List[str], Optional[int], str]]:
+    """
+    Packs each section's blocks into (path, first page, text) chunks of at most max_words,
+    headings without a body only live on in breadcrumbs.
+    """
+    chunks: List[Tuple[List[str], Optional[int], str]] = []
+    for section in sections:
+      breadcrumb = " > ".join(section.path)
+      budget = self.max_words - len(breadcrumb.split())
+      current: List[str] = []
+      current_page: Optional[int] = None
+      current_words = 0
+      for page, block in section.blocks:
+        for piece in self._fit(block, budget):
+          words = len(piece.split())
+          if current and current_words + words > budget:
+            chunks.append((section.path, current_page, _join(breadcrumb, current)))
+            current, current_words = [], 0
+          if not current:
+            current_page = page
+          current.append(piece)
+          current_words += words
+      if current:
+        chunks.append((section.path, current_page, _join(breadcrumb, current)))
+    return chunks
+
+  def _fit(self, block: str, budget: int) -> List[str]:
+    """A block as is when it fits, otherwise cut into pieces that do."""
+    budget = max(1, budget)
+    if len(block.split()) <= budget:
+      return [block]
+    lines = block.splitlines()
+    if all(_is_table_row(line) for line in lines) and len(lines) > 2:
+      # Whole rows per piece, each with the table header so the columns stay labelled
+      header, rows = lines[:2], lines[2:]
+      header_words = len(" ".join(header).split())
+      pieces, current = [], []
+      for row in rows:
+        if current and header_words + len(" ".join(current + [row]).split()) > budget:
+          pieces.append("\n".join(header + current))
+          current = []
+        current.append(row)
+      pieces.append("\n".join(header + current))
+      return pieces
+    words = block.split()
+    return [" ".join(words[i:i + budget]) for i in range(0, len(words), budget)]
+
+
+def _is_table_row(line: str) -> bool:
+  return line.lstrip().startswith("|")
+
+
+def _join(breadcrumb: str, blocks: List[str]) -> str:
+  return "\n\n".join(part for part in [breadcrumb, *blocks] if part)
@@ -0,0 +1,91 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from haystack import Document, component
+from neo4j_haystack import Neo4jDocumentStore
+
+COMPARISONS = {"==": "=", "!=": "<>", ">": ">", ">=": ">=", "<": "<", "<=": "<=", "in": "IN"}
+LOGICAL = {"AND": " AND ", "OR": " OR "}
+
+
+def node_property(field: str) -> str:
+  """
+  Node property holding a Haystack filter field. Neo4jDocumentStore flattens `meta` onto the node,
+  `meta.game` is stored as `game` (neo4j-haystack's own filter translation would look for `meta_game`).
+  """
+  return field[len("meta."):] if field.startswith("meta.") else field
+
+
+def where_clause(filters: Optional[Dict[str, Any]], node: str = "doc") -> Tuple[str, Dict[str, Any]]:
+  """Cypher WHERE clause and its parameters for Haystack filters, on the properties documents are stored under."""
+  if not filters:
+    return "", {}
+  parameters: Dict[str, Any] = {}
+
+  def condition(filter: Dict[str, Any]) -> str:
+    operator = filter["operator"]
+    if operator in LOGICAL:
+      return "(" + LOGICAL[operator].join(condition(nested) for nested in filter["conditions"]) + ")"
+    if operator == "NOT":
+      return "NOT (" + " AND ".join(condition(nested) for nested in filter["conditions"]) + ")"
+    if operator == "not in":
+      return "NOT " + condition({**filter, "operator": "in"})
+    if operator not in COMPARISONS:
+      raise ValueError(f"Unsupported filter operator: {operator}")
+    name = f"p{len(parameters)}"
+    parameters[name] = filter["value"]
+    return f"{node}.`{node_property(filter['field'])}` {COMPARISONS[operator]} ${name}"
+
+  return f"WHERE {condition(filters)}", parameters
+
+
+def create_filter_index(document_store: Neo4jDocumentStore, field: str = "meta.game") -> None:
+  """
+  Range index on the filtered property, so a filtered query reads one game's chunks instead of
+  scanning the label. Idempotent, called by the index build while it holds the build lock.
+  """
+  name = f"{document_store.node_label}_{node_property(field)}".replace(".", "_")
+  document_store.neo4j_client.execute_write(
+    f"CREATE INDEX `{name}` IF NOT EXISTS FOR (doc:`{document_store.node_label}`) ON (doc.`{node_property(field)}`)")
+
+
+@component
+class Neo4jFilteredRetriever:
+  """
+  Neo4j vector retriever for a shared multi-game index.
+  The vector index applies metadata filters after its nearest neighbour search, so a game with a small
+  share of the chunks could get fewer than `top_k` of them. With filters the matching chunks are
+  selected first and ranked by exact similarity, a scan of one game's chunks instead of the whole index.
+  """
+  def __init__(self, document_store: Neo4jDocumentStore, top_k: int = 10):
+    self.document_store = document_store
+    self.top_k = top_k
+
+  @component.output_types(documents=List[Document])
+  def run(self, query_embedding: List[float], filters: Optional[Dict[str, Any]] = None, top_k: Optional[int] = None):
+    top_k = top_k or self.top_k
+    # Stand-in stores (see app.utils.LocalStandIns) already filter before ranking
+    if not filters or not isinstance(self.document_store, Neo4jDocumentStore):
+      return {"documents": self.document_store.query_by_embedding(query_embedding, filters=filters, top_k=top_k)}
+    return {"documents": self._query_filtered(query_embedding, filters, top_k)}
+
+  def _query_filtered(self, query_embedding: List[float], filters: Dict[str, Any], top_k: int) -> List[Document]:
+    store = self.document_store
+    where, where_parameters = where_clause(filters)
+    similarity = "cosine" if store.similarity == "cosine" else "euclidean"
+    _, records = store.neo4j_client.execute_read(
+      f"""
+      MATCH (doc:`{store.node_label}`) {where}
+      WITH doc, vector.similarity.{similarity}(doc.`{store.embedding_field}`, $embedding) AS score
+      WHERE score IS NOT NULL
+      RETURN doc{{.*, `{store.embedding_field}`: null}} AS doc, score
+      ORDER BY score DESC LIMIT $top_k
+      """,
+      parameters={"embedding": query_embedding, "top_k": top_k, **where_parameters})
+    documents = [Document.from_dict({**record["doc"], "score": record["score"]}) for record in records]
+    for document in documents:
+      # Same scale as Neo4jDocumentStore.query_by_embedding with scale_score=True
+      document.score = (
+        (document.score + 1) / 2 if store.similarity == "cosine"
+        else float(1 / (1 + np.exp(-document.score / 100))))
+    return documents
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from app.services.AnswerCache import AnswerCache
+
+DEFAULT_QUERY_LOG_PATH = Path(__file__).parent.parent.parent / "data" / "query_log.sqlite3"
+
+
+class QueryLog:
+  """
+  Counts of the questions players ask, one row per normalized question and game with the
+  latest wording and when it was first and last asked. Shared by every worker on the host
+  through a SQLite file in WAL mode, capped at `max_entries` by dropping the least asked.
+  """
+  # Pruning scans the table, done once every this many records
+  PRUNE_EVERY = 100
+
+  def __init__(self, path: Optional[str] = None, max_entries: int = 10000):
+    self.path = Path(path or DEFAULT_QUERY_LOG_PATH)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self.max_entries = max_entries
+    self._local = threading.local()
+    self._records = 0
+    self._lock = threading.Lock()
+    with self._connection() as connection:
+      connection.execute("""
+        CREATE TABLE IF NOT EXISTS questions (
+          scope TEXT NOT NULL,
+          key TEXT NOT NULL,
+          question TEXT NOT NULL,
+          count INTEGER NOT NULL,
+          first_asked REAL NOT NULL,
+          last_asked REAL NOT NULL,
+          PRIMARY KEY (scope, key))
+      """)
+
+  def _connection(self) -> sqlite3.Connection:
+    # sqlite3 connections can't be shared across threads, keep one per thread
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.path, timeout=5)
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      self._local.connection = connection
+    return connection
+
+  def record(self, question: str, scope: Optional[str] = None) -> None:
+    now = time.time()
+    with self._connection() as connection:
+      connection.execute("""
+        INSERT INTO questions (scope, key, question, count, first_asked, last_asked) VALUES (?, ?, ?, 1, ?, ?)
+        ON CONFLICT (scope, key) DO UPDATE SET
+          question = excluded.question, count = count + 1, last_asked = excluded.last_asked
+      """, (scope or "", AnswerCache.normalize(question), question.strip(), now, now))
+    with self._lock:
+      self._records += 1
+      prune = self._records % self.PRUNE_EVERY == 0
+    if prune:
+      self.prune()
+
+  def prune(self) -> None:
+    with self._connection() as connection:
+      connection.execute("""
+        DELETE FROM questions WHERE rowid IN (
+          SELECT rowid FROM questions ORDER BY count DESC, last_asked DESC LIMIT -1 OFFSET ?)
+      """, (self.max_entries,))
+
+  def top(self, n: int) -> List[Tuple[str, Optional[str], int]]:
+    """The `n` most asked questions as (question, scope, count), most recent first among equal counts."""
+    with self._connection() as connection:
+      rows = connection.execute(
+        "SELECT question, scope, count FROM questions ORDER BY count DESC, last_asked DESC LIMIT ?",
+        (n,)).fetchall()
+    return [(question, scope or None, count) for question, scope, count in rows]
+
+  def close(self) -> None:
+    connection = getattr(self._local, "connection", None)
+    if connection is not None:
+      connection.close()
+      self._local.connection = None
@@ -1,47 +1,139 @@
+import asyncio
+import fcntl
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from contextvars import copy_context
+from functools import partial
 from pathlib import Path
 from textwrap import dedent
+from typing import (AsyncContextManager, AsyncIterator, Callable, Dict, Iterator,
+                    List, Optional, Tuple, Union)
 
+from app.services.AnswerCache import AnswerCache, CachedAnswer
+from app.services.BackendClients import BackendClients
+from app.services.CacheBackend import create_cache_backend
+from app.services.ContextAssembler import ContextAssembler
+from app.services.ConcurrentDocumentEmbedder import ConcurrentDocumentEmbedder
+from app.services.Corpus import UnknownGame, corpus_scope, load_corpus, split_pages
+from app.services.FaqAnswers import FaqAnswer, FaqAnswers
+from app.services.GenerationScheduler import (UNREACHABLE,
+                                              GenerationBackend,
+                                              GenerationRejected,
+                                              GenerationScheduler)
+from app.services.IndexManifest import IndexManifest, chunk_hash
+from app.services.MarkdownSectionSplitter import MarkdownSectionSplitter
+from app.services.LocalVectorIndex import (LocalEmbeddingRetriever,
+                                           LocalVectorIndex)
+from app.services.Neo4jFilteredRetriever import Neo4jFilteredRetriever, create_filter_index
+from app.services.QueryLog import QueryLog
+from app.utils import metrics
+from app.utils.concurrency import generation_urls, max_concurrent_queries
 from dotenv import load_dotenv
 from haystack import Document, Pipeline
 from haystack.components.builders import PromptBuilder
-from haystack.components.converters import MarkdownToDocument
+from haystack.components.converters import MarkdownToDocument, TextFileToDocument
 from haystack.components.joiners import DocumentJoiner
 from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
+from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
 from haystack.components.writers import DocumentWriter
+from haystack.dataclasses import ByteStream, StreamingChunk
 from haystack.document_stores.in_memory import InMemoryDocumentStore
 from haystack.document_stores.types import DuplicatePolicy
 from haystack_integrations.components.embedders.ollama import (
     OllamaDocumentEmbedder, OllamaTextEmbedder)
 from haystack_integrations.components.generators.ollama import OllamaGenerator
-from neo4j_haystack import Neo4jDocumentStore, Neo4jEmbeddingRetriever
+from neo4j_haystack import Neo4jDocumentStore
 
 # Load .env file but don't override existing environment variables (set by Docker)
 load_dotenv(dotenv_path=Path(__file__).parent.parent.parent / ".env", override=False)
 
+
+def _references(documents: List[Document]) -> List[dict]:
+  return [
+    {"id": document.id, "score": document.score, "content": document.content, "page": document.meta.get("page")}
+    for document in documents
+  ]
+
+
 class RAGService:
-  def __init__(self):
-    self.document_store = Neo4jDocumentStore(
-      url=os.getenv("NEO4J_URI"),
-      database=os.getenv("NEO4J_DATABASE"),
-      username=os.getenv("NEO4J_USERNAME"),
-      password=os.getenv("NEO4J_PASSWORD"),
+  def __init__(self, document_store: Optional[Neo4jDocumentStore] = None):
+    # One Neo4j driver and one Ollama connection pool for every component, see BackendClients
+    self.clients = BackendClients()
+    # A stand-in store can be passed for benchmarks, see app.utils.LocalStandIns
+    self.document_store = document_store or Neo4jDocumentStore(
+      neo4j_client=self.clients.neo4j,
       index=os.getenv("NEO4J_INDEX"), # The name of the Vector Index in Neo4j
       node_label=os.getenv("NEO4J_NODE_LABEL"), # Providing a label to Neo4j nodes which store Documents
       embedding_field="embedding",
       embedding_dim=768,
-      recreate_index=True,
+      # Never dropped here, every worker constructs a store: full rebuilds recreate it under the build lock
+      recreate_index=False,
       progress_bar=True
     )
+    self.preprocessing_pipeline = Pipeline()
     self.embedding_pipeline = Pipeline()
     self.query_pipeline = Pipeline()
+    self.vector_index = None
+    self.keyword_store = None
+    self.text_embedder = None
+    self.batch_embedder = None
+    self.prompt_builder = None
+    self.generator = None
+    self.generation_scheduler = None
+    # Called with (stage, seconds) after each embed/retrieve/prompt_build/generate step
+    self.stage_observers: List[Callable[[str, float], None]] = [metrics.observe_stage]
+    # Query embeddings and answers share one backend, see CACHE_BACKEND
+    self.cache_backend = create_cache_backend()
+    self.answer_cache = AnswerCache(
+      backend=self.cache_backend,
+      ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+      similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")))
+    self.index_version = None
+    # Questions asked through the API, the most asked get their answers precomputed at startup
+    self.query_log = QueryLog(
+      path=os.getenv("QUERY_LOG_PATH"),
+      max_entries=int(os.getenv("QUERY_LOG_MAX_ENTRIES", "10000")))
+    metrics.REGISTRY.register(metrics.Gauge(
+      "rag_answer_cache_entries", "Answers cached for the current index version.",
+      callback=lambda: {(): self.answer_cache.stats()["entries"]},
+      # Every worker counts the same entries of a shared backend
+      aggregate="max" if self.cache_backend.shared else "sum"))
+    # Bounded pool for blocking pipeline runs, keeps them off the event loop
+    self.executor = ThreadPoolExecutor(
+      max_workers=max_concurrent_queries(),
+      thread_name_prefix="rag-query")
+    # Questions being answered right now, keyed like the answer cache
+    self._inflight: Dict[str, asyncio.Future] = {}
+
+  @property
+  def index_version(self) -> Optional[str]:
+    return self._index_version
 
-  def build_embeddings(self, path_to_markdown: str) -> bool:
+  @index_version.setter
+  def index_version(self, index_version: Optional[str]) -> None:
+    # Cached answers are tied to the index they were generated from
+    self._index_version = index_version
+    self.answer_cache.set_index_version(index_version)
+
+  def build_embeddings(self, path_to_markdown: str, incremental: bool = True) -> bool:
+    """
+    Split the markdown (a single file or a corpus directory, see load_corpus) into chunks and sync them into Neo4j.
+    Chunks are content-addressed, so in incremental mode only new or changed
+    chunks are embedded and chunks that disappeared are deleted.
+    """
     try:
+      # "markdown" chunks along headings and keeps tables whole, "word" cuts every 200 words
+      markdown_chunking = os.getenv("CHUNKING_MODE", "word").lower() == "markdown"
       document_converter = MarkdownToDocument(
         table_to_single_line=False,
         progress_bar=True,
         store_full_path=False)
+      if markdown_chunking:
+        # Raw markdown, MarkdownToDocument renders it to plain text and loses the headings
+        document_converter = TextFileToDocument(store_full_path=False)
       document_joiner = DocumentJoiner()
       document_cleaner = DocumentCleaner(
         remove_empty_lines=True,
@@ -63,37 +155,125 @@ class RAGService:
         use_split_rules=True,
         extend_abbreviations=True,
         skip_empty_documents=True)
-      document_embedder = OllamaDocumentEmbedder(
+      if markdown_chunking:
+        document_splitter = MarkdownSectionSplitter(max_words=int(os.getenv("CHUNK_MAX_WORDS", "300")))
+      document_embedder = self.clients.share_with(ConcurrentDocumentEmbedder(
         model=os.getenv("OLLAMA_EMBEDDING_MODEL"),
-        url=os.getenv("OLLAMA_BASE_URL"))
+        url=os.getenv("OLLAMA_BASE_URL"),
+        batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
+        max_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+        max_retries=int(os.getenv("EMBEDDING_MAX_RETRIES", "3")),
+        progress_bar=False))
       document_writer = DocumentWriter(
         document_store=self.document_store,
         policy=DuplicatePolicy.OVERWRITE)
 
+      self.preprocessing_pipeline = Pipeline()
+      # Add components to the pipeline
+      self.preprocessing_pipeline.add_component(instance=document_converter, name="document_converter")
+      self.preprocessing_pipeline.add_component(instance=document_joiner, name="document_joiner")
+      self.preprocessing_pipeline.add_component(instance=document_splitter, name="document_splitter")
+      # Connect components
+      self.preprocessing_pipeline.connect("document_converter", "document_joiner")
+      if markdown_chunking:
+        # The cleaner would drop the blank lines that separate blocks, the splitter drops empty lines itself
+        self.preprocessing_pipeline.connect("document_joiner", "document_splitter")
+      else:
+        self.preprocessing_pipeline.add_component(instance=document_cleaner, name="document_cleaner")
+        self.preprocessing_pipeline.connect("document_joiner", "document_cleaner")
+        self.preprocessing_pipeline.connect("document_cleaner", "document_splitter")
+
       self.embedding_pipeline = Pipeline()
       # Add components to the pipeline
-      self.embedding_pipeline.add_component(instance=document_converter, name="document_converter")
-      self.embedding_pipeline.add_component(instance=document_joiner, name="document_joiner")
-      self.embedding_pipeline.add_component(instance=document_cleaner, name="document_cleaner")
-      self.embedding_pipeline.add_component(instance=document_splitter, name="document_splitter")
       self.embedding_pipeline.add_component(instance=document_embedder, name="document_embedder")
       self.embedding_pipeline.add_component(instance=document_writer, name="document_writer")
       # Connect components
-      self.embedding_pipeline.connect("document_converter", "document_joiner")
-      self.embedding_pipeline.connect("document_joiner", "document_cleaner")
-      self.embedding_pipeline.connect("document_cleaner", "document_splitter")
-      self.embedding_pipeline.connect("document_splitter", "document_embedder")
       self.embedding_pipeline.connect("document_embedder", "document_writer")
 
-      self.embedding_pipeline.run(({
-        "document_converter": {"sources": [path_to_markdown]}
-        }
-      ))
+      sources, sources_meta = [], []
+      for document in load_corpus(path_to_markdown):
+        pages = [] if markdown_chunking else split_pages(Path(document.path).read_text(encoding="utf-8"))
+        if markdown_chunking or pages[0][0] is None:
+          # MarkdownSectionSplitter numbers the pages itself, its sections carry on across them
+          sources.append(document.path)
+          sources_meta.append(document.meta)
+          continue
+        # MarkdownToDocument drops the form feeds, each page is converted on its own to keep its number
+        for page, text in pages:
+          sources.append(ByteStream.from_string(text))
+          sources_meta.append({**document.meta, "file_path": Path(document.path).name, "page": page})
+      with self.timed("index_preprocess"):
+        chunks = self.preprocessing_pipeline.run(({
+          "document_converter": {
+            "sources": sources,
+            "meta": sources_meta
+          }
+          }
+        ))["document_splitter"]["documents"]
+
+      # Content-address every chunk, identical chunks of the same game collapse into one document
+      documents: dict[str, Document] = {}
+      for chunk in chunks:
+        chunk.id = chunk_hash(chunk.content, scope=corpus_scope(chunk.meta))
+        documents.setdefault(chunk.id, chunk)
+
+      embedding_model = os.getenv("OLLAMA_EMBEDDING_MODEL")
+      manifest = IndexManifest().load()
+      if not incremental or manifest.embedding_model not in (None, embedding_model):
+        # Full rebuild, vectors from another embedding model can't be reused
+        if isinstance(self.document_store, Neo4jDocumentStore):
+          # Drops the vector index with its documents, a new model may have another dimension
+          self.document_store.delete_index()
+          self.document_store.create_index()
+        else:
+          self.document_store.delete_all_documents()
+        manifest.reset(embedding_model=embedding_model)
+      elif manifest.embedding_model is None or len(manifest.hashes) != self.document_store.count_documents():
+        # Missing or stale manifest, trust what is actually stored in Neo4j
+        stored = self.document_store.get_all_documents_generator(return_embedding=False)
+        manifest.reset(hashes=(doc.id for doc in stored), embedding_model=embedding_model)
+
+      if isinstance(self.document_store, Neo4jDocumentStore):
+        create_filter_index(self.document_store)
+
+      new_documents = [doc for doc_id, doc in documents.items() if doc_id not in manifest.hashes]
+      stale_ids = sorted(manifest.hashes - documents.keys())
+
+      if stale_ids:
+        self.document_store.delete_documents(document_ids=stale_ids)
+      if new_documents:
+        with self.timed("index_embed"):
+          self.embedding_pipeline.run({
+            "document_embedder": {"documents": new_documents}
+          })
+
+      manifest.hashes = set(documents)
+      manifest.save()
+      self.index_version = manifest.version
+      print(f"Index {manifest.version}: {len(new_documents)} chunks embedded, "
+            f"{len(stale_ids)} removed, {len(documents) - len(new_documents)} unchanged")
       return True
     except Exception as e:
       print(f"Error in markdown_to_vector_embeeding: {e}")
       return None
 
+  def attach_index(self) -> bool:
+    """Attach to an index built by another process, without touching Ollama."""
+    manifest = IndexManifest()
+    if not manifest.path.exists():
+      print(f"Error in attach_index: no index manifest at {manifest.path}, run `python -m app.index build`")
+      return None
+    manifest.load()
+    embedding_model = os.getenv("OLLAMA_EMBEDDING_MODEL")
+    if manifest.embedding_model != embedding_model:
+      # Questions embedded by another model than the chunks would retrieve unrelated ones
+      print(f"Error in attach_index: index {manifest.version} was embedded with {manifest.embedding_model}, "
+            f"not {embedding_model}, run `python -m app.index build`")
+      return None
+    self.index_version = manifest.version
+    print(f"Attached to index {self.index_version}")
+    return True
+
   def build_query_pipeline(self):
     try:
       template = dedent("""
@@ -102,36 +282,89 @@ class RAGService:
         You must provide the text from the context as a reference.
 
         Context:
-        {% for document in documents %}
-            {{ document.content }}
-        {% endfor %}
+        {% for document in documents -%}
+        {{ document.content }}
 
+        {% endfor -%}
         Question: {{ question }}
         Answer:
-      """)
+      """).strip()
 
-      embedder = OllamaTextEmbedder(
+      self.text_embedder = self.clients.share_with(OllamaTextEmbedder(
+        model=os.getenv("OLLAMA_EMBEDDING_MODEL"),
+        url=os.getenv("OLLAMA_BASE_URL")))
+      # Embeds the questions of a batch in one Ollama request, sized to the largest batch /query/batch accepts
+      self.batch_embedder = self.clients.share_with(OllamaDocumentEmbedder(
         model=os.getenv("OLLAMA_EMBEDDING_MODEL"),
-        url=os.getenv("OLLAMA_BASE_URL"))
-      retriever = Neo4jEmbeddingRetriever(
-        document_store=self.document_store)
-      augmenter = PromptBuilder(
+        url=os.getenv("OLLAMA_BASE_URL"),
+        batch_size=int(os.getenv("RAG_MAX_BATCH_SIZE", "100")),
+        progress_bar=False))
+      top_k = int(os.getenv("RETRIEVER_TOP_K", "10"))
+      hybrid = os.getenv("RETRIEVAL_MODE", "vector").lower() == "hybrid"
+      # In hybrid mode each retriever fetches extra candidates, fusion keeps the best top_k
+      if os.getenv("VECTOR_ENGINE", "neo4j").lower() == "local":
+        # Local copy of the Neo4j vectors, answers top-k without a network round trip
+        self.vector_index = LocalVectorIndex.load_or_export(self.document_store, self.index_version)
+        retriever = LocalEmbeddingRetriever(
+          vector_index=self.vector_index,
+          top_k=top_k * 2 if hybrid else top_k)
+      else:
+        self.vector_index = None
+        retriever = Neo4jFilteredRetriever(
+          document_store=self.document_store,
+          top_k=top_k * 2 if hybrid else top_k)
+      self.prompt_builder = PromptBuilder(
         template=template,
         required_variables=["documents", "question"])
-      generator = OllamaGenerator(
-        model=os.getenv("OLLAMA_GENERATIVE_MODEL"),
-        url=os.getenv("OLLAMA_BASE_URL"))
+      # One generator per Ollama server, each answer goes to the least busy one
+      self.generation_scheduler = GenerationScheduler(
+        backends=[
+          GenerationBackend(
+            url=url,
+            generator=self.clients.share_with(OllamaGenerator(
+              model=os.getenv("OLLAMA_GENERATIVE_MODEL"),
+              url=url)),
+            max_in_flight=int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "4")))
+          for url in generation_urls()],
+        max_queued=int(os.getenv("GENERATION_MAX_QUEUED", "16")),
+        queue_timeout=float(os.getenv("GENERATION_QUEUE_TIMEOUT", "30")),
+        cooldown=float(os.getenv("GENERATION_BACKEND_COOLDOWN", "10")))
+      self.generator = self.generation_scheduler.backends[0].generator
+
+      # Dedups, merges and trims the retrieved chunks to a token budget, prompt length drives generation time
+      context_assembler = ContextAssembler(
+        token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048")),
+        duplicate_threshold=float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.9")))
 
+      # The embedder, prompt builder and generator run on their own: the question embedding is
+      # needed by the answer cache, retrieved context is sent before the answer streams,
+      # and each stage is timed separately
       self.query_pipeline = Pipeline()
       # Add components to the pipeline
-      self.query_pipeline.add_component(instance=embedder, name="embedder")
       self.query_pipeline.add_component(instance=retriever, name="retriever")
-      self.query_pipeline.add_component(instance=augmenter, name="augmenter")
-      self.query_pipeline.add_component(instance=generator, name="generator")
-      # Connect components
-      self.query_pipeline.connect("embedder.embedding", "retriever.query_embedding")
-      self.query_pipeline.connect("retriever", "augmenter.documents")
-      self.query_pipeline.connect("augmenter.prompt", "generator.prompt")
+      self.query_pipeline.add_component(instance=context_assembler, name="context_assembler")
+      if hybrid:
+        # BM25 over the same chunks catches exact terms (card names, stats) that dense retrieval misses
+        self.keyword_store = InMemoryDocumentStore()
+        self.keyword_store.write_documents(
+          self.vector_index.documents if self.vector_index is not None
+          else list(self.document_store.get_all_documents_generator(return_embedding=False)),
+          policy=DuplicatePolicy.OVERWRITE)
+        bm25_retriever = InMemoryBM25Retriever(
+          document_store=self.keyword_store,
+          top_k=top_k * 2)
+        document_joiner = DocumentJoiner(
+          join_mode="reciprocal_rank_fusion",
+          top_k=top_k)
+        self.query_pipeline.add_component(instance=bm25_retriever, name="bm25_retriever")
+        self.query_pipeline.add_component(instance=document_joiner, name="document_joiner")
+        # Connect components
+        self.query_pipeline.connect("retriever", "document_joiner")
+        self.query_pipeline.connect("bm25_retriever", "document_joiner")
+        self.query_pipeline.connect("document_joiner", "context_assembler")
+      else:
+        # Connect components
+        self.query_pipeline.connect("retriever", "context_assembler")
 
       self.query_pipeline.warm_up()
 
@@ -140,20 +373,351 @@ class RAGService:
       print(f"Error in query_pipeline_setup: {e}")
       return None
 
+  def warm_up_models(self) -> None:
+    """
+    Loads the embedding and generative models into Ollama, which otherwise happens on the first question.
+    Bypasses the caches, raises when Ollama can't embed or no generation backend answers.
+    """
+    with self.timed("warm_up"):
+      self.text_embedder.run(text="warm up")
+      # Every generation backend loads its own copy of the model, one that is down doesn't hold up the others
+      errors = []
+      for backend in self.generation_scheduler.backends:
+        try:
+          backend.generator.run(prompt="warm up", generation_kwargs={"num_predict": 1})
+        except Exception as e:
+          print(f"Error in warm_up_models: {backend.url}: {e}")
+          errors.append(e)
+      if len(errors) == len(self.generation_scheduler.backends):
+        raise errors[0]
 
-  def query(self, question: str) -> str:
+  def record_question(self, question: str, game: Optional[str] = None) -> None:
+    # Only feeds the FAQ warm-up, a failure to log never fails the question
     try:
-      response = self.query_pipeline.run(
-        data={
-          "embedder": {"text": question},
-          "augmenter": {"question": question}
-        }
-      )
-      return response["generator"]["replies"][0]
+      self.query_log.record(question, scope=game)
     except Exception as e:
+      print(f"Error in record_question: {e}")
+
+  def load_faq_answers(self) -> int:
+    """Puts the answers stored for the current index version into the answer cache, returns how many."""
+    if self.cache_backend.max_entries <= 0:
+      return 0
+    answers = FaqAnswers(self.index_version).load(os.getenv("OLLAMA_GENERATIVE_MODEL"))
+    for faq in answers:
+      self.answer_cache.put(faq.question, faq.embedding, faq.answer, faq.references, scope=faq.game)
+    return len(answers)
+
+  def precompute_faq(self, top_n: int, stop: Optional[threading.Event] = None) -> int:
+    """
+    Answers the `top_n` most asked questions of the query log for the current index version and stores
+    the answers on disk, returns how many are stored. One worker of the host generates them, one at a
+    time so live questions keep the other generation slots, the other workers wait and load its answers.
+    """
+    top_n = min(top_n, self.cache_backend.max_entries)
+    if top_n <= 0:
+      return 0
+    store = FaqAnswers(self.index_version)
+    store.directory.mkdir(parents=True, exist_ok=True)
+    with open(store.lock_path, "w") as lock_file:
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        print("Another worker is precomputing FAQ answers, waiting for it...")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return self.load_faq_answers()
+      try:
+        return self._precompute_faq(store, top_n, stop)
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def _precompute_faq(self, store: FaqAnswers, top_n: int, stop: Optional[threading.Event]) -> int:
+    generative_model = os.getenv("OLLAMA_GENERATIVE_MODEL")
+    answers = {AnswerCache.key(faq.question, faq.game): faq for faq in store.load(generative_model)}
+    top = [(AnswerCache.key(question, game), question, game) for question, game, _ in self.query_log.top(top_n)]
+    generated = 0
+    with self.timed("faq_warm_up"):
+      for key, question, game in top:
+        if stop is not None and stop.is_set():
+          break
+        if key in answers:
+          continue
+        try:
+          answers[key] = self._faq_answer(question, game)
+        except GenerationRejected:
+          # Live traffic has every backend busy, it warms the cache by itself
+          print("Generation backends are busy, stopping the FAQ warm-up")
+          break
+        except Exception as e:
+          print(f"Error in precompute_faq: {question!r}: {e}")
+          continue
+        generated += 1
+        # Saved as it goes, a restart keeps what was generated so far
+        store.save(list(answers.values()), generative_model)
+    if top and not (stop is not None and stop.is_set()):
+      # Questions that fell out of the top are not kept
+      top_keys = {key for key, _, _ in top}
+      answers = {key: faq for key, faq in answers.items() if key in top_keys}
+      store.save(list(answers.values()), generative_model)
+    print(f"FAQ warm-up: {generated} answers generated, {len(answers)} stored for index {self.index_version}")
+    return len(answers)
+
+  def _faq_answer(self, question: str, game: Optional[str]) -> FaqAnswer:
+    cached = self.answer_cache.peek(question, scope=game)
+    if cached is not None:
+      # Already answered for this index, by live traffic or another worker through a shared cache
+      return FaqAnswer(question, game, cached.answer, cached.references, cached.embedding.tolist())
+    embedding = self.embed(question)
+    retrieved = self.retrieve(question, embedding, game)
+    answer = self.generate(retrieved["prompt"])
+    references = _references(retrieved["documents"])
+    self.answer_cache.put(question, embedding, answer, references, scope=game)
+    return FaqAnswer(question, game, answer, references, [float(value) for value in embedding])
+
+
+  @contextmanager
+  def timed(self, stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - start
+      for observer in self.stage_observers:
+        observer(stage, elapsed)
+      timings = metrics.request_timings.get()
+      if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+  def embed(self, question: str) -> List[float]:
+    namespace = f"embeddings:{self.text_embedder.model}"
+    key = AnswerCache.normalize(question)
+    with self.timed("embed"):
+      embedding = self.cache_backend.get(namespace, key)
+      metrics.EMBEDDING_CACHE.inc(result="miss" if embedding is None else "hit")
+      if embedding is None:
+        embedding = self.text_embedder.run(text=question)["embedding"]
+        self.cache_backend.set(namespace, key, embedding)
+    return embedding
+
+  def embed_many(self, questions: List[str]) -> List[List[float]]:
+    """Embeddings of several questions, the ones not cached are embedded together."""
+    namespace = f"embeddings:{self.text_embedder.model}"
+    keys = [AnswerCache.normalize(question) for question in questions]
+    with self.timed("embed"):
+      embeddings = {key: self.cache_backend.get(namespace, key) for key in keys}
+      # One text per distinct question, embedded as asked like embed() does
+      missing = {key: question for key, question in zip(keys, questions) if embeddings[key] is None}
+      metrics.EMBEDDING_CACHE.inc(len(keys) - len(missing), result="hit")
+      metrics.EMBEDDING_CACHE.inc(len(missing), result="miss")
+      if missing:
+        embedded = self.batch_embedder.run(
+          documents=[Document(content=question) for question in missing.values()])["documents"]
+        for key, document in zip(missing, embedded):
+          embeddings[key] = document.embedding
+          self.cache_backend.set(namespace, key, document.embedding)
+    return [embeddings[key] for key in keys]
+
+  def retrieve(self, question: str, query_embedding: List[float], game: Optional[str] = None) -> dict:
+    """Run the query pipeline and build the prompt, returns the retrieved documents and the prompt."""
+    # Narrow retrieval to one game of the shared index
+    filters = {"field": "meta.game", "operator": "==", "value": game} if game else None
+    data = {"retriever": {"query_embedding": query_embedding, "filters": filters}}
+    if "bm25_retriever" in self.query_pipeline.graph.nodes:
+      data["bm25_retriever"] = {"query": question, "filters": filters}
+    with self.timed("retrieve"):
+      documents = self.query_pipeline.run(data=data)["context_assembler"]["documents"]
+    metrics.RETRIEVED_DOCUMENTS.observe(len(documents))
+    if game and not documents:
+      # Retrieval filters before ranking, so no chunk at all means the game isn't indexed
+      raise UnknownGame(game)
+    with self.timed("prompt_build"):
+      prompt = self.prompt_builder.run(documents=documents, question=question)["prompt"]
+    return {"documents": documents, "prompt": prompt}
+
+  def generate(self, prompt: str, streaming_callback: Optional[Callable[[StreamingChunk], None]] = None) -> str:
+    attempts = len(self.generation_scheduler.backends)
+    for attempt in range(attempts):
+      try:
+        with ExitStack() as stack:
+          with self.timed("generate_wait"):
+            # Raises GenerationRejected when every backend is busy and the queue is full or too slow
+            backend = stack.enter_context(self.generation_scheduler.slot())
+          with self.timed("generate"):
+            result = backend.generator.run(prompt=prompt, streaming_callback=streaming_callback)
+        break
+      except UNREACHABLE:
+        # The scheduler now skips that backend, try the next one
+        if attempt == attempts - 1:
+          raise
+    usage = result["meta"][0].get("usage", {}) if result.get("meta") else {}
+    if usage.get("prompt_tokens") is not None:
+      metrics.PROMPT_TOKENS.observe(usage["prompt_tokens"])
+    if usage.get("completion_tokens") is not None:
+      metrics.COMPLETION_TOKENS.observe(usage["completion_tokens"])
+    return result["replies"][0]
+
+  def lookup_cache(
+    self, question: str, game: Optional[str] = None, embedding: Optional[List[float]] = None
+  ) -> Tuple[Optional[CachedAnswer], Optional[List[float]]]:
+    """Exact cache tier first, then embeds the question (unless given) for the semantic tier."""
+    cached = self.answer_cache.get_exact(question, scope=game)
+    if cached is not None:
+      metrics.ANSWER_CACHE.inc(result="exact")
+      return cached, None
+    if embedding is None:
+      embedding = self.embed(question)
+    cached = self.answer_cache.get_semantic(embedding, scope=game)
+    metrics.ANSWER_CACHE.inc(result="miss" if cached is None else "semantic")
+    return cached, embedding
+
+  def query(self, question: str, game: Optional[str] = None, embedding: Optional[List[float]] = None) -> str:
+    try:
+      cached, embedding = self.lookup_cache(question, game, embedding)
+      if cached is not None:
+        metrics.QUERIES.inc(mode="blocking", status="cached")
+        return cached.answer
+      retrieved = self.retrieve(question, embedding, game)
+      answer = self.generate(retrieved["prompt"])
+      self.answer_cache.put(question, embedding, answer, _references(retrieved["documents"]), scope=game)
+      metrics.QUERIES.inc(mode="blocking", status="answered")
+      return answer
+    except GenerationRejected:
+      metrics.QUERIES.inc(mode="blocking", status="rejected")
+      raise
+    except UnknownGame:
+      metrics.QUERIES.inc(mode="blocking", status="unknown_game")
+      raise
+    except Exception as e:
+      metrics.QUERIES.inc(mode="blocking", status="error")
       print(f"Error in query: {e}")
       return None
 
+  async def aquery(
+    self,
+    question: str,
+    game: Optional[str] = None,
+    admission: Optional[Callable[[], AsyncContextManager]] = None,
+    embedding: Optional[List[float]] = None
+  ) -> str:
+    """
+    Async variant of query(), runs the pipeline on the service's executor.
+    Concurrent calls for the same normalized question and game share one run (single-flight),
+    only that run goes through `admission` (e.g. ConcurrencyLimiter.slot).
+    """
+    key = AnswerCache.key(question, game)
+    inflight = self._inflight.get(key)
+    if inflight is None:
+      inflight = asyncio.ensure_future(self._admitted_query(question, game, admission, embedding))
+      self._inflight[key] = inflight
+      inflight.add_done_callback(partial(self._forget_inflight, key))
+    else:
+      metrics.QUERIES.inc(mode="blocking", status="coalesced")
+    # Shielded, a caller that goes away must not cancel the run the others wait on
+    return await asyncio.shield(inflight)
+
+  def _forget_inflight(self, key: str, inflight: asyncio.Future) -> None:
+    self._inflight.pop(key, None)
+    if not inflight.cancelled():
+      # Marks a failure as seen even if every caller went away
+      inflight.exception()
+
+  async def _admitted_query(
+    self,
+    question: str,
+    game: Optional[str],
+    admission: Optional[Callable[[], AsyncContextManager]],
+    embedding: Optional[List[float]] = None
+  ) -> str:
+    loop = asyncio.get_running_loop()
+    async with admission() if admission is not None else nullcontext():
+      # Executor threads don't inherit context variables, carry request_timings over explicitly
+      return await loop.run_in_executor(self.executor, copy_context().run, self.query, question, game, embedding)
+
+  async def abatch_query(
+    self, items: List[Tuple[str, Optional[str]]], concurrency: int = 2
+  ) -> AsyncIterator[Tuple[int, Optional[str], Optional[Union[GenerationRejected, UnknownGame]]]]:
+    """
+    Answer a batch of (question, game) pairs, yields (index, answer, rejection) as answers complete.
+    All questions are embedded in one request up front, then at most `concurrency`
+    of them retrieve and generate at a time. Duplicates and cached answers cost nothing extra.
+    A question shed by the generation scheduler or asked about an unknown game comes back with its
+    rejection, the others still run.
+    """
+    loop = asyncio.get_running_loop()
+    embeddings = await loop.run_in_executor(
+      self.executor, copy_context().run, self.embed_many, [question for question, _ in items])
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(
+      index: int, question: str, game: Optional[str], embedding: List[float]
+    ) -> Tuple[int, Optional[str], Optional[Union[GenerationRejected, UnknownGame]]]:
+      async with semaphore:
+        try:
+          return index, await self.aquery(question, game, embedding=embedding), None
+        except (GenerationRejected, UnknownGame) as e:
+          return index, None, e
+
+    tasks = [
+      asyncio.ensure_future(answer(index, question, game, embedding))
+      for index, ((question, game), embedding) in enumerate(zip(items, embeddings))
+    ]
+    try:
+      for next_answer in asyncio.as_completed(tasks):
+        yield await next_answer
+    finally:
+      # The caller went away, don't start the questions still waiting for a slot
+      for task in tasks:
+        task.cancel()
+
+  async def astream_query(self, question: str, game: Optional[str] = None) -> AsyncIterator[dict]:
+    """
+    Stream an answer as events: a "context" event with the retrieved references,
+    then a "token" event per generated chunk, then "done" with the full answer.
+    """
+    loop = asyncio.get_running_loop()
+    cached, embedding = await loop.run_in_executor(
+      self.executor, copy_context().run, self.lookup_cache, question, game)
+    if cached is not None:
+      metrics.QUERIES.inc(mode="stream", status="cached")
+      yield {"event": "context", "data": {"references": cached.references}}
+      yield {"event": "token", "data": {"token": cached.answer}}
+      yield {"event": "done", "data": {"answer": cached.answer}}
+      return
+
+    retrieved = await loop.run_in_executor(
+      self.executor, copy_context().run, self.retrieve, question, embedding, game)
+    references = _references(retrieved["documents"])
+    yield {"event": "context", "data": {"references": references}}
+
+    tokens: asyncio.Queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def on_chunk(chunk: StreamingChunk) -> None:
+      # Raising here aborts the Ollama stream once the client has gone away
+      if stopped.is_set():
+        raise RuntimeError("Stream closed by client")
+      loop.call_soon_threadsafe(tokens.put_nowait, chunk.content)
+
+    generation = loop.run_in_executor(
+      self.executor, copy_context().run, partial(self.generate, retrieved["prompt"], streaming_callback=on_chunk))
+    generation.add_done_callback(lambda _: tokens.put_nowait(None))
+    try:
+      while (token := await tokens.get()) is not None:
+        if token:
+          yield {"event": "token", "data": {"token": token}}
+      answer = await generation
+      self.answer_cache.put(question, embedding, answer, references, scope=game)
+      metrics.QUERIES.inc(mode="stream", status="answered")
+      yield {"event": "done", "data": {"answer": answer}}
+    finally:
+      stopped.set()
+
+  def close(self) -> None:
+    self.executor.shutdown(wait=False, cancel_futures=True)
+    self.cache_backend.close()
+    self.query_log.close()
+    self.clients.close()
+
 if __name__ == "__main__":
   rag_service = RAGService()
 
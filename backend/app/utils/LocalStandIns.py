@@ -0,0 +1,188 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from dataclasses import replace
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+
+# Local stand-ins for Ollama and Neo4j, so the RAG service can be benchmarked without network or GPU
+
+
+def fake_embedding(text: str, dim: int = 768) -> List[float]:
+  """Hashed bag of words, texts sharing words end up close so retrieval still returns related chunks."""
+  vector = np.zeros(dim, dtype=np.float32)
+  for word in re.findall(r"\w+", text.lower()):
+    vector[int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:4], "little") % dim] += 1.0
+  norm = np.linalg.norm(vector)
+  return (vector / norm if norm else vector).tolist()
+
+
+class FakeOllamaServer:
+  """
+  HTTP server speaking the parts of the Ollama API the RAG service uses (/api/embed, /api/generate),
+  with configurable latency. Generation sleeps for the time to first token, then streams
+  `answer_tokens` tokens at `tokens_per_second`. Like OLLAMA_NUM_PARALLEL, at most `parallel`
+  generations run at once and the others wait, so one server saturates like one GPU does.
+  """
+  def __init__(
+    self,
+    embed_latency: float = 0.02,
+    first_token_latency: float = 0.2,
+    tokens_per_second: float = 50.0,
+    answer_tokens: int = 50,
+    dim: int = 768,
+    parallel: int = 4,
+    host: str = "127.0.0.1",
+    port: int = 0
+  ):
+    self.embed_latency = embed_latency
+    self.first_token_latency = first_token_latency
+    self.tokens_per_second = tokens_per_second
+    self.answer_tokens = answer_tokens
+    self.dim = dim
+    self._generation_slots = threading.Semaphore(parallel)
+    self._server = ThreadingHTTPServer((host, port), self._handler())
+    self._server.daemon_threads = True
+    # TCP connections accepted, fewer than requests when clients keep connections alive
+    self.connections = 0
+    self._connections_lock = threading.Lock()
+    self._thread: Optional[threading.Thread] = None
+
+  @property
+  def url(self) -> str:
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}"
+
+  def start(self) -> "FakeOllamaServer":
+    self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self) -> None:
+    self._server.shutdown()
+    self._server.server_close()
+
+  def tokens(self) -> Iterator[str]:
+    with self._generation_slots:
+      time.sleep(self.first_token_latency)
+      for i in range(self.answer_tokens):
+        if i:
+          time.sleep(1 / self.tokens_per_second)
+        yield f"token{i} "
+
+  def _handler(self):
+    server = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+      # Like Ollama's Go server, otherwise kept-alive connections wait on delayed ACKs
+      disable_nagle_algorithm = True
+
+      def log_message(self, format, *args):
+        pass
+
+      def setup(self):
+        super().setup()
+        with server._connections_lock:
+          server.connections += 1
+
+      def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/api/embed":
+          inputs = body.get("input", [])
+          inputs = [inputs] if isinstance(inputs, str) else inputs
+          time.sleep(server.embed_latency)
+          self._send_json({
+            "model": body.get("model"),
+            "embeddings": [fake_embedding(text, server.dim) for text in inputs]})
+        elif self.path == "/api/embeddings":
+          time.sleep(server.embed_latency)
+          self._send_json({"embedding": fake_embedding(body.get("prompt", ""), server.dim)})
+        elif self.path == "/api/generate":
+          if body.get("stream", True):
+            self._stream_generate(body)
+          else:
+            self._send_json(self._generate_chunk(body, "".join(server.tokens()), done=True))
+        else:
+          self._send_json({"error": f"{self.path} not found"}, status=404)
+
+      def do_GET(self):
+        if self.path == "/api/ps":
+          self._send_json({"models": []})
+        else:
+          self._send_json({"error": f"{self.path} not found"}, status=404)
+
+      def _generate_chunk(self, body: Dict[str, Any], response: str, done: bool) -> Dict[str, Any]:
+        chunk = {
+          "model": body.get("model"),
+          "created_at": datetime.now(timezone.utc).isoformat(),
+          "response": response,
+          "done": done}
+        if done:
+          chunk.update(
+            done_reason="stop",
+            prompt_eval_count=len(body.get("prompt", "").split()),
+            eval_count=server.answer_tokens)
+        return chunk
+
+      def _stream_generate(self, body: Dict[str, Any]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in server.tokens():
+          self._write_chunk(self._generate_chunk(body, token, done=False))
+        self._write_chunk(self._generate_chunk(body, "", done=True))
+        self.wfile.write(b"0\r\n\r\n")
+
+      def _write_chunk(self, data: Dict[str, Any]) -> None:
+        line = json.dumps(data).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+      def _send_json(self, data: Dict[str, Any], status: int = 200) -> None:
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    return Handler
+
+
+class InMemoryNeo4jStore(InMemoryDocumentStore):
+  """
+  In-process stand-in for the Neo4jDocumentStore methods the RAG service calls,
+  every vector query waits `query_latency` seconds to model the Neo4j round trip.
+  """
+  def __init__(self, query_latency: float = 0.01):
+    super().__init__(embedding_similarity_function="cosine")
+    self.query_latency = query_latency
+
+  def query_by_embedding(
+    self,
+    query_embedding: List[float],
+    filters: Optional[Dict[str, Any]] = None,
+    top_k: int = 10,
+    scale_score: bool = True,
+    return_embedding: bool = False,
+    expand_top_k: Optional[int] = None
+  ) -> List[Document]:
+    time.sleep(self.query_latency)
+    return self.embedding_retrieval(
+      query_embedding, filters=filters, top_k=top_k, scale_score=scale_score, return_embedding=return_embedding)
+
+  def get_all_documents_generator(self, return_embedding: bool = True) -> Iterator[Document]:
+    for document in self.filter_documents():
+      yield document if return_embedding else replace(document, embedding=None)
+
+  def delete_all_documents(self) -> None:
+    self.delete_documents([document.id for document in self.filter_documents()])
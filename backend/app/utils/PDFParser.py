@@ -1,8 +1,10 @@
+import hashlib
 import os
 import time
-from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO, StringIO
 from pathlib import Path
-from typing import Callable
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from docling.datamodel import vlm_model_specs
 from docling.datamodel.accelerator_options import (AcceleratorDevice,
@@ -18,8 +20,12 @@ from docling.datamodel.pipeline_options_vlm_model import (ApiVlmOptions,
 from docling.document_converter import DocumentConverter, PdfFormatOption
 from docling.pipeline.vlm_pipeline import VlmPipeline
 from dotenv import load_dotenv
-from pdfminer.high_level import extract_text, extract_text_to_fp
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
 from pypdf import PdfReader as PyPDFPdfReader
+from pypdf import PdfWriter as PyPDFPdfWriter
 from PyPDF2 import PdfReader as PyPDF2PdfReader
 
 load_dotenv()
@@ -28,6 +34,72 @@ ollama_url   = os.getenv("OLLAMA_BASE_URL")
 ollama_model = os.getenv("OLLAMA_MODEL")
 DRG_PDF_PATH = Path(__file__).parent.parent.parent / "data" / "raw_documents" / "DRG_2E_Rulebook.pdf"
 output_dir   = Path(__file__).parent.parent.parent / "data" / "processed_documents"
+cache_dir    = Path(__file__).parent.parent.parent / "data" / "conversion_cache"
+# "auto" picks CUDA when available and falls back to CPU on ingestion boxes without a GPU
+accelerator_device = AcceleratorDevice(os.getenv("DOCLING_DEVICE", "auto"))
+# Separates the pages of the docling markdown: the form feed of write_pages as a paragraph of its own,
+# which the markdown converters and MarkdownSectionSplitter drop
+PAGE_BREAK = "\n\n\f\n\n"
+
+
+def ocr_pipeline_options(device: AcceleratorDevice = accelerator_device, num_threads: int = 4) -> PdfPipelineOptions:
+  """Pipeline options of docling_ocr_parser, shared with its parallel variant."""
+  return PdfPipelineOptions(
+    generate_table_images=True,
+    enable_parallel_processing=True,
+    do_ocr=True,
+    ocr_options = RapidOcrOptions(lang=["english"]),
+    do_table_structure=True,
+    generate_picture_images=True,
+    generate_page_images=True,
+    do_formula_enrichment=True,
+    images_scale=2,
+    table_structure_options={"do_cell_matching": True, "mode": TableFormerMode.ACCURATE},
+    accelerator_options=AcceleratorOptions(num_threads=num_threads, device=device),
+  )
+
+
+# Converter of a docling_parallel_parser worker process, models are loaded once per process
+_worker_converter: Optional[DocumentConverter] = None
+
+def _init_worker(num_threads: int):
+  global _worker_converter
+  pipeline_options = ocr_pipeline_options(device=AcceleratorDevice.CPU, num_threads=num_threads)
+  _worker_converter = DocumentConverter(format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)})
+
+def _convert_page_range(pdf_path: str, page_range: Tuple[int, int]) -> Dict[int, str]:
+  """Converts pages start..end (1-based, inclusive) and returns the markdown of each page."""
+  document = _worker_converter.convert(source=pdf_path, page_range=page_range).document
+  return {
+    page_no: document.export_to_markdown(image_mode="embedded", page_no=page_no)
+    for page_no in sorted(document.pages)
+  }
+
+
+def export_pages(document, **kwargs) -> str:
+  """Markdown of a converted DoclingDocument page by page, separated by PAGE_BREAK so page numbers survive."""
+  return PAGE_BREAK.join(
+    document.export_to_markdown(page_no=page_no, **kwargs)
+    for page_no in sorted(document.pages))
+
+
+def prune_conversion_cache(max_age_days: float) -> None:
+  """
+  Removes cached pages not used for `max_age_days`: pages replaced by an errata,
+  pages of PDFs no longer converted and whole directories of old pipeline options.
+  """
+  if not cache_dir.exists():
+    return
+  cutoff = time.time() - max_age_days * 86400
+  for options_dir in cache_dir.iterdir():
+    if not options_dir.is_dir():
+      continue
+    for path in options_dir.glob("*.md"):
+      if path.stat().st_mtime < cutoff:
+        path.unlink(missing_ok=True)
+    if not any(options_dir.iterdir()):
+      options_dir.rmdir()
+
 
 class PDFParser:
   def __init__(self, pdf_path: str):
@@ -38,34 +110,61 @@ class PDFParser:
     else:
       self.pdf_path = pdf_path
 
-  def pypdf2_parser(self):
-    """PyPDF2 Parser, produces txt, worst outcome"""
+  def iter_pypdf2_pages(self) -> Iterator[Tuple[int, str]]:
+    """Yields (page_number, text) per page with PyPDF2, 1-based."""
     reader = PyPDF2PdfReader(self.pdf_path)
+    for page_number, page in enumerate(reader.pages, start=1):
+      yield page_number, page.extract_text()
+
+  def iter_pypdf_pages(self) -> Iterator[Tuple[int, str]]:
+    """Yields (page_number, text) per page with pypdf, 1-based."""
+    reader = PyPDFPdfReader(self.pdf_path)
+    for page_number, page in enumerate(reader.pages, start=1):
+      yield page_number, page.extract_text()
+
+  def iter_pdf_miner_pages(self) -> Iterator[Tuple[int, str]]:
+    """Yields (page_number, text) per page with PDFMiner, same layout analysis as extract_text."""
+    resource_manager = PDFResourceManager()
+    buffer = StringIO()
+    converter = TextConverter(resource_manager, buffer, laparams=LAParams())
+    interpreter = PDFPageInterpreter(resource_manager, converter)
+    try:
+      with open(self.pdf_path, "rb") as fin:
+        for page_number, page in enumerate(PDFPage.get_pages(fin), start=1):
+          interpreter.process_page(page)
+          # TextConverter ends every page with a form feed, write_pages adds its own
+          yield page_number, buffer.getvalue().rstrip("\f")
+          buffer.seek(0)
+          buffer.truncate()
+    finally:
+      converter.close()
+
+  def write_pages(self, pages: Iterable[Tuple[int, str]], suffix: str) -> Path:
+    """
+    Writes pages to disk as they are extracted, separated by form feeds so that
+    the index build can tell which page a chunk came from (see app.services.Corpus.split_pages).
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
-    output_path = output_dir / f"{os.path.basename(self.pdf_path).replace('.pdf', '')}_pypdf2.txt"
+    output_path = output_dir / f"{os.path.basename(self.pdf_path).replace('.pdf', '')}_{suffix}.txt"
     with open(output_path, "w", encoding="utf-8") as f:
-      for page in reader.pages:
-        f.write(page.extract_text())
+      for page_number, text in pages:
+        if page_number > 1:
+          f.write("\f")
+        f.write(text)
     print(f"Extracted text saved to: {output_path}")
+    return output_path
+
+  def pypdf2_parser(self):
+    """PyPDF2 Parser, produces txt, worst outcome"""
+    return self.write_pages(self.iter_pypdf2_pages(), "pypdf2")
 
   def pypdf_parser(self):
     """PyPDF Parser, produces txt, better than pypdf2."""
-    reader = PyPDFPdfReader(self.pdf_path)
-    output_dir.mkdir(parents=True, exist_ok=True)
-    output_path = output_dir / f"{os.path.basename(self.pdf_path).replace('.pdf', '')}_pypdf.txt"
-    with open(output_path, "w", encoding="utf-8") as f:
-      for page in reader.pages:
-        f.write(page.extract_text())
-    print(f"Extracted text saved to: {output_path}")
+    return self.write_pages(self.iter_pypdf_pages(), "pypdf")
 
   def pdf_miner_parser(self):
     """PDFMiner Parser, produces txt, better than pypdf"""
-    with open(self.pdf_path, 'rb') as fin:
-      text = extract_text(fin)
-    output_path = output_dir / f"{os.path.basename(self.pdf_path).replace('.pdf', '')}_pdfminer.txt"
-    with open(output_path, "w", encoding="utf-8") as f:
-      f.write(text)
-    print(f"Extracted text saved to: {output_path}")
+    return self.write_pages(self.iter_pdf_miner_pages(), "pdfminer")
 
   def docling_parser(self):
     """Default Docling Parser, sucks, don't use it."""
@@ -79,7 +178,7 @@ class PDFParser:
       generate_page_images=False,
       do_formula_enrichment=True,
       table_structure_options={"do_cell_matching": True, "mode": TableFormerMode.ACCURATE},
-      accelerator_options=AcceleratorOptions(num_threads=4, device=AcceleratorDevice.CUDA),
+      accelerator_options=AcceleratorOptions(num_threads=4, device=accelerator_device),
     )
 
     format_options = {InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
@@ -88,14 +187,15 @@ class PDFParser:
 
     output_path = output_dir / f"{os.path.basename(self.pdf_path).replace('.pdf', '')}_docling.md"
     with open(output_path, "w", encoding="utf-8") as f:
-      f.write(result.export_to_markdown())
+      f.write(export_pages(result.document))
 
     print(f"Extracted text saved to: {output_path}")
+    return output_path
 
   def docling_vlm_parser(self):
     pipeline_options = VlmPipelineOptions()
 
-    pipeline_options.accelerator_options = AcceleratorOptions(num_threads=8, device=AcceleratorDevice.CUDA)
+    pipeline_options.accelerator_options = AcceleratorOptions(num_threads=8, device=accelerator_device)
     pipeline_options.do_ocr = True
     pipeline_options.do_table_structure = True
     pipeline_options.table_structure_options.do_cell_matching = True
@@ -112,9 +212,10 @@ class PDFParser:
 
     output_path = output_dir / f"{os.path.basename(self.pdf_path).replace('.pdf', '')}_docling_vlm.md"
     with open(output_path, "w", encoding="utf-8") as f:
-      f.write(result.export_to_markdown())
+      f.write(export_pages(result))
 
     print(f"Extracted text saved to: {output_path}")
+    return output_path
 
   def docling_ocr_parser(self):
     """
@@ -123,51 +224,81 @@ class PDFParser:
     produces markdown, with images embedded.
     Best outcome.
     """
-    pipeline_options = PdfPipelineOptions(
-      generate_table_images=True,
-      enable_parallel_processing=True,
-      do_ocr=True,
-      ocr_options = RapidOcrOptions(lang=["english"]),
-      do_table_structure=True,
-      generate_picture_images=True,
-      generate_page_images=True,
-      do_formula_enrichment=True,
-      images_scale=2,
-      table_structure_options={"do_cell_matching": True, "mode": TableFormerMode.ACCURATE},
-      accelerator_options=AcceleratorOptions(num_threads=4, device=AcceleratorDevice.CUDA),
-    )
+    pipeline_options = ocr_pipeline_options()
 
     format_options = {InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
     converter      = DocumentConverter(format_options=format_options)
     result         = converter.convert(source=self.pdf_path)
-    markdown_text  = result.document.export_to_markdown(image_mode="embedded")
+    markdown_text  = export_pages(result.document, image_mode="embedded")
 
     output_path = output_dir / f"{os.path.basename(self.pdf_path).replace('.pdf', '')}_docling_ocr_base.md"
     with open(output_path, "w", encoding="utf-8") as f:
       f.write(markdown_text)
 
     print(f"Extracted text saved to: {output_path}")
+    return output_path
 
+  def docling_parallel_parser(self, max_workers: Optional[int] = None, pages_per_shard: int = 4):
+    """
+    docling_ocr_parser split into page ranges converted across a CPU process pool,
+    merged back in page order. Each page's markdown is cached by the hash of the page
+    and of the pipeline options, so after a one-page errata only that page is reconverted.
+    Cached pages not used for CONVERSION_CACHE_MAX_AGE_DAYS are removed.
+    Every worker loads its own layout and OCR models, DOCLING_MAX_WORKERS bounds the memory.
+    """
+    max_workers = min(max_workers or int(os.getenv("DOCLING_MAX_WORKERS", "2")), os.cpu_count() or 1)
+    num_threads = max(1, (os.cpu_count() or 1) // max_workers)
+    # Threads and device change the speed, not the output, they stay out of the cache key
+    options_json = ocr_pipeline_options(device=AcceleratorDevice.CPU, num_threads=num_threads).model_dump_json(
+      exclude={"accelerator_options"})
+    page_cache_dir = cache_dir / hashlib.sha256(options_json.encode("utf-8")).hexdigest()[:16]
+    page_cache_dir.mkdir(parents=True, exist_ok=True)
 
+    reader = PyPDFPdfReader(self.pdf_path)
+    page_paths: Dict[int, Path] = {}
+    for page_no, page in enumerate(reader.pages, start=1):
+      # A single-page PDF of the page, covers its text, images and fonts
+      writer = PyPDFPdfWriter()
+      writer.add_page(page)
+      buffer = BytesIO()
+      writer.write(buffer)
+      page_paths[page_no] = page_cache_dir / f"{hashlib.sha256(buffer.getvalue()).hexdigest()}.md"
 
+    # Contiguous runs of uncached pages, cut into shards of at most pages_per_shard pages
+    shards: List[Tuple[int, int]] = []
+    for page_no in sorted(page_no for page_no, path in page_paths.items() if not path.exists()):
+      if shards and shards[-1][1] == page_no - 1 and shards[-1][1] - shards[-1][0] + 1 < pages_per_shard:
+        shards[-1] = (shards[-1][0], page_no)
+      else:
+        shards.append((page_no, page_no))
+    print(f"{len(page_paths) - sum(end - start + 1 for start, end in shards)} of {len(page_paths)} pages cached, "
+          f"converting {len(shards)} shards on {max_workers} processes")
 
-if __name__ == "__main__":
-  """Run all parsers and measure time taken."""
-  pdf_parser = PDFParser(DRG_PDF_PATH)
-
-  func_dict: dict[str, Callable] = {
-    "pypdf2_parser": pdf_parser.pypdf2_parser,
-    "pypdf_parser": pdf_parser.pypdf_parser,
-    "pdf_miner_parser": pdf_parser.pdf_miner_parser,
-    "docling_parser": pdf_parser.docling_parser,
-    "docling_ocr_parser": pdf_parser.docling_ocr_parser,
-  }
+    if shards:
+      with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(num_threads,)) as pool:
+        for pages in pool.map(_convert_page_range, [self.pdf_path] * len(shards), shards):
+          for page_no, markdown in pages.items():
+            page_paths[page_no].write_text(markdown, encoding="utf-8")
+    for path in page_paths.values():
+      if path.exists():
+        # Marks the page as used, see prune_conversion_cache
+        path.touch()
+    prune_conversion_cache(float(os.getenv("CONVERSION_CACHE_MAX_AGE_DAYS", "30")))
 
-  for func_name, func in func_dict.items():
-    try:
-      time_start = time.time()
-      func()
-      time_end = time.time()
-      print(f"Time taken {func_name}: {time_end - time_start} seconds")
-    except Exception as e:
-      print(f"Error in {func_name}: {e}")
+    output_path = output_dir / f"{os.path.basename(self.pdf_path).replace('.pdf', '')}_docling_parallel.md"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+      f.write(PAGE_BREAK.join(
+        page_paths[page_no].read_text(encoding="utf-8") if page_paths[page_no].exists() else ""
+        for page_no in sorted(page_paths)))
+
+    print(f"Extracted text saved to: {output_path}")
+    return output_path
+
+
+
+
+if __name__ == "__main__":
+  # Timings, peak memory and fidelity scores of every parser, see app/utils/ParserBenchmark.py
+  from app.utils.ParserBenchmark import main
+  raise SystemExit(main())
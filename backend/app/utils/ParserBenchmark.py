@@ -0,0 +1,214 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import psutil
+from pypdf import PdfReader as PyPDFPdfReader
+
+# python -m app.utils.ParserBenchmark --parsers pypdf_parser pdf_miner_parser
+DEFAULT_GOLDEN_DIR = Path(__file__).parent.parent.parent / "data" / "golden_pages"
+DEFAULT_RESULTS_DIR = Path(__file__).parent.parent.parent / "data" / "benchmarks"
+# How often the parser's process tree is measured for its peak RSS
+RSS_SAMPLE_SECONDS = 0.1
+PARSERS = [
+  "pypdf2_parser",
+  "pypdf_parser",
+  "pdf_miner_parser",
+  "docling_parser",
+  "docling_ocr_parser",
+  "docling_parallel_parser",
+]
+
+
+def _run_parser(pdf_path: str, parser_name: str, connection) -> None:
+  """Runs one parser in a fresh process so its peak RSS and CPU time are its own."""
+  try:
+    # Imported here, the docling models are only loaded in the benchmarked process
+    from app.utils.PDFParser import PDFParser
+    cpu_start = _cpu_seconds()
+    start = time.perf_counter()
+    output_path = getattr(PDFParser(pdf_path), parser_name)()
+    seconds = time.perf_counter() - start
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    connection.send({
+      "seconds": seconds,
+      "cpu_seconds": _cpu_seconds() - cpu_start,
+      # ru_maxrss is in KiB on Linux, the benchmark adds up the process pool of docling_parallel_parser itself
+      "peak_rss_mb": max(own.ru_maxrss, children.ru_maxrss) / 1024,
+      "output_path": str(output_path) if output_path else None,
+    })
+  except Exception as e:
+    connection.send({"error": f"{type(e).__name__}: {e}"})
+  finally:
+    connection.close()
+
+
+def _cpu_seconds() -> float:
+  # Children cover the process pool of docling_parallel_parser
+  own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+  return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _tree_rss_mb(pid: int) -> float:
+  """Current RSS of a process and all its descendants, the workers of a process pool add up."""
+  try:
+    root = psutil.Process(pid)
+    processes = [root] + root.children(recursive=True)
+  except psutil.NoSuchProcess:
+    return 0.0
+  total = 0
+  for process in processes:
+    try:
+      total += process.memory_info().rss
+    except psutil.NoSuchProcess:
+      pass
+  return total / (1024 * 1024)
+
+
+def normalize_words(text: str) -> List[str]:
+  """Lower-cased words without markdown markup, so txt and md outputs compare on their text alone."""
+  text = re.sub(r"!\[[^\]]*\]\([^)]*\)", " ", text) # embedded images
+  return re.findall(r"[a-z0-9]+(?:['’][a-z]+)?", text.lower())
+
+
+def fidelity(golden_text: str, extracted_text: str, n: int = 3) -> Dict[str, float]:
+  """
+  How much of a golden page survives extraction.
+  word_recall ignores order, ngram_recall also needs the words in reading order,
+  which catches column interleaving and tables split into loose cells.
+  """
+  golden, extracted = normalize_words(golden_text), normalize_words(extracted_text)
+  if not golden:
+    return {"word_recall": 1.0, "ngram_recall": 1.0}
+  extracted_words = set(extracted)
+  golden_ngrams = {tuple(golden[i:i + n]) for i in range(max(1, len(golden) - n + 1))}
+  extracted_ngrams = {tuple(extracted[i:i + n]) for i in range(max(1, len(extracted) - n + 1))}
+  return {
+    "word_recall": sum(word in extracted_words for word in golden) / len(golden),
+    "ngram_recall": len(golden_ngrams & extracted_ngrams) / len(golden_ngrams),
+  }
+
+
+def score_output(output_path: str, golden_pages: List[dict]) -> Optional[dict]:
+  """
+  Scores a parser output against the golden pages, each page against its own page of the output.
+  Every parser separates pages with form feeds, a page missing from the output scores zero.
+  """
+  if not golden_pages or not output_path:
+    return None
+  pages = Path(output_path).read_text(encoding="utf-8").split("\f")
+  scores = {}
+  for golden in golden_pages:
+    page = golden["page"]
+    scores[str(page)] = fidelity(golden["text"], pages[page - 1] if page <= len(pages) else "")
+  return {
+    "pages": scores,
+    "word_recall": sum(score["word_recall"] for score in scores.values()) / len(scores),
+    "ngram_recall": sum(score["ngram_recall"] for score in scores.values()) / len(scores),
+  }
+
+
+def load_golden_pages(pdf_path: str, golden_path: Optional[str] = None) -> List[dict]:
+  """
+  Hand-labelled reference text of a few pages, data/golden_pages/<pdf name>.json by default:
+  [{"page": 12, "text": "..."}], page numbers are 1-based. data/golden_pages/parser_sample.pdf
+  comes with its golden pages: prose, a two-column page drawn line by line across the columns and a table.
+  """
+  path = Path(golden_path) if golden_path else DEFAULT_GOLDEN_DIR / f"{Path(pdf_path).stem}.json"
+  if not path.exists():
+    print(f"No golden pages at {path}, skipping fidelity scores")
+    return []
+  with open(path, "r", encoding="utf-8") as f:
+    return json.load(f)
+
+
+def benchmark(pdf_path: str, parsers: List[str], golden_path: Optional[str] = None, timeout: Optional[float] = None) -> dict:
+  pages = len(PyPDFPdfReader(pdf_path).pages)
+  golden_pages = load_golden_pages(pdf_path, golden_path)
+  # spawn, a forked child would start with the parent's RSS
+  context = multiprocessing.get_context("spawn")
+  results = {}
+  for parser_name in parsers:
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_parser, args=(pdf_path, parser_name, sender), name=f"bench-{parser_name}")
+    process.start()
+    sender.close()
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    tree_rss_mb = 0.0
+    # Polled until the result (or EOF) arrives, a process pool is only measured while it runs
+    while not (reported := receiver.poll(RSS_SAMPLE_SECONDS)):
+      tree_rss_mb = max(tree_rss_mb, _tree_rss_mb(process.pid))
+      if deadline is not None and time.monotonic() >= deadline:
+        break
+    if reported:
+      try:
+        result = receiver.recv()
+      except EOFError:
+        result = None
+    else:
+      process.terminate()
+      result = {"error": f"Timed out after {timeout} seconds"}
+    process.join()
+    if result is None:
+      # Killed before reporting back, e.g. by the OOM killer
+      result = {"error": f"Exited with code {process.exitcode}"}
+
+    if "error" not in result:
+      result["peak_rss_mb"] = max(result["peak_rss_mb"], tree_rss_mb)
+      result["pages_per_second"] = pages / result["seconds"] if result["seconds"] else None
+      result["fidelity"] = score_output(result["output_path"], golden_pages)
+    results[parser_name] = result
+    print(f"{parser_name}: {_summary(result)}")
+
+  return {
+    "pdf": os.path.basename(pdf_path),
+    "pages": pages,
+    "golden_pages": [golden["page"] for golden in golden_pages],
+    "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    "cpu_count": os.cpu_count(),
+    "parsers": results,
+  }
+
+
+def _summary(result: dict) -> str:
+  if "error" in result:
+    return f"failed, {result['error']}"
+  summary = (f"{result['pages_per_second'] or 0:.2f} pages/s, {result['cpu_seconds']:.1f}s CPU, "
+             f"{result['peak_rss_mb']:.0f} MB peak RSS")
+  if result["fidelity"]:
+    summary += (f", word recall {result['fidelity']['word_recall']:.3f}, "
+                f"3-gram recall {result['fidelity']['ngram_recall']:.3f}")
+  return summary
+
+
+def main() -> int:
+  from app.utils.PDFParser import DRG_PDF_PATH
+
+  parser = argparse.ArgumentParser(prog="python -m app.utils.ParserBenchmark", description="Benchmark the PDF parsers.")
+  parser.add_argument("--pdf", default=str(DRG_PDF_PATH), help="PDF to parse.")
+  parser.add_argument("--parsers", nargs="+", default=PARSERS, choices=PARSERS, help="Parsers to run, all by default.")
+  parser.add_argument("--golden", help="Golden pages JSON, data/golden_pages/<pdf name>.json by default.")
+  parser.add_argument("--timeout", type=float, help="Seconds before a parser is abandoned.")
+  parser.add_argument("--output", help="Results JSON, data/benchmarks/parsers-<timestamp>.json by default.")
+  args = parser.parse_args()
+
+  results = benchmark(args.pdf, args.parsers, golden_path=args.golden, timeout=args.timeout)
+  output_path = Path(args.output) if args.output else \
+    DEFAULT_RESULTS_DIR / f"parsers-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+  output_path.parent.mkdir(parents=True, exist_ok=True)
+  with open(output_path, "w", encoding="utf-8") as f:
+    json.dump(results, f, indent=2)
+  print(f"Benchmark results saved to: {output_path}")
+  return 0 if all("error" not in result for result in results["parsers"].values()) else 1
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+  # Only imported by serve(), the annotation needs the name
+  import uvicorn
+
+# python -m app.utils.RAGBenchmark --requests 200 --concurrency 16
+# Serves the FastAPI app from one local uvicorn worker against local stand-ins for Ollama and Neo4j (see
+# app.utils.LocalStandIns), or against the configured services with --live.
+DEFAULT_RESULTS_DIR = Path(__file__).parent.parent.parent / "data" / "benchmarks"
+DEFAULT_QUESTIONS = [
+  "What are some special features of the driller?",
+  "How does the scout's flare gun work?",
+  "What happens when a dwarf is downed?",
+  "How many actions does a dwarf get per turn?",
+  "How is nitra spent during a mission?",
+  "What does the engineer's platform gun do?",
+  "When do the glyphid swarms spawn?",
+  "How do you resupply ammunition?",
+  "What is the gunner's shield generator for?",
+  "How do you win a mining expedition?",
+]
+STAGES = ["embed", "retrieve", "prompt_build", "generate_wait", "generate"]
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+  if not samples:
+    return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+  p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+  return {"count": len(samples), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def synthetic_corpus(directory: Path, sections: int = 200) -> Path:
+  """A rulebook-shaped markdown file, used when the real corpus isn't available (e.g. on CI)."""
+  rng = random.Random(0)
+  words = " ".join(DEFAULT_QUESTIONS).lower().replace("?", "").split()
+  path = directory / "synthetic_rulebook.md"
+  with open(path, "w", encoding="utf-8") as f:
+    for section in range(sections):
+      f.write(f"## Rule {section}\n\n")
+      for _ in range(3):
+        f.write(" ".join(rng.choice(words) for _ in range(60)).capitalize() + ".\n\n")
+  return path
+
+
+async def run_load(base_url: str, token: str, questions: List[str], requests: int, concurrency: int, endpoint: str) -> dict:
+  import httpx
+
+  latencies: List[float] = []
+  first_tokens: List[float] = []
+  statuses: Counter = Counter()
+  queue: asyncio.Queue = asyncio.Queue()
+  for i in range(requests):
+    queue.put_nowait(questions[i % len(questions)])
+
+  async def user(client: "httpx.AsyncClient") -> None:
+    while not queue.empty():
+      question = queue.get_nowait()
+      start = time.perf_counter()
+      try:
+        if endpoint == "stream":
+          async with client.stream("GET", "/query/stream", params={"question": question}) as response:
+            first_token = None
+            async for line in response.aiter_lines():
+              if first_token is None and line == "event: token":
+                first_token = time.perf_counter() - start
+            if first_token is not None:
+              first_tokens.append(first_token)
+        else:
+          response = await client.get("/query", params={"question": question})
+        statuses[str(response.status_code)] += 1
+        if response.status_code == 200:
+          latencies.append(time.perf_counter() - start)
+      except Exception as e:
+        statuses[type(e).__name__] += 1
+
+  async with httpx.AsyncClient(
+    base_url=base_url, timeout=None, headers={"Authorization": f"Bearer {token}"},
+    limits=httpx.Limits(max_connections=concurrency)
+  ) as client:
+    start = time.perf_counter()
+    await asyncio.gather(*(user(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+  return {
+    "seconds": elapsed,
+    "requests_per_second": len(latencies) / elapsed if elapsed else None,
+    "statuses": dict(statuses),
+    "latency": percentiles(latencies),
+    "time_to_first_token": percentiles(first_tokens) if endpoint == "stream" else None,
+  }
+
+
+def serve(app) -> Tuple["uvicorn.Server", threading.Thread, str]:
+  """Serves the app from one uvicorn worker in a background thread, the way it runs in production."""
+  import uvicorn
+
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+  # The RAG service is set up by the benchmark, not by the app's lifespan
+  server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+  thread = threading.Thread(target=server.run, name="rag-benchmark-server", daemon=True)
+  thread.start()
+  while not server.started:
+    time.sleep(0.05)
+  return server, thread, f"http://127.0.0.1:{port}"
+
+
+def benchmark(args: argparse.Namespace) -> dict:
+  workdir = Path(tempfile.mkdtemp(prefix="rag-benchmark-"))
+  fake_ollama = None
+  fake_generators = []
+  if not args.live:
+    from app.utils.LocalStandIns import FakeOllamaServer
+    fake_ollama = FakeOllamaServer(
+      embed_latency=args.embed_latency,
+      first_token_latency=args.first_token_latency,
+      tokens_per_second=args.tokens_per_second,
+      answer_tokens=args.answer_tokens,
+      parallel=args.ollama_parallel).start()
+    # Extra "GPU boxes", the first server both embeds and generates
+    fake_generators = [fake_ollama] + [
+      FakeOllamaServer(
+        first_token_latency=args.first_token_latency,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        parallel=args.ollama_parallel).start()
+      for _ in range(args.generation_backends - 1)]
+    # Keep the benchmark index and caches away from the real ones
+    os.environ.update({
+      "OLLAMA_BASE_URL": fake_ollama.url,
+      "OLLAMA_EMBEDDING_MODEL": "fake-embedding",
+      "OLLAMA_GENERATIVE_MODEL": "fake-generative",
+      "INDEX_MANIFEST_PATH": str(workdir / "index_manifest.json"),
+      "LOCAL_VECTOR_INDEX_DIR": str(workdir / "vector_index"),
+      "CACHE_SQLITE_PATH": str(workdir / "cache.sqlite3"),
+      "QUERY_LOG_PATH": str(workdir / "query_log.sqlite3"),
+      "FAQ_ANSWERS_DIR": str(workdir / "faq_answers"),
+      "OLLAMA_GENERATION_URLS": ",".join(server.url for server in fake_generators),
+    })
+  if args.no_cache:
+    os.environ["CACHE_MAX_ENTRIES"] = "0"
+
+  # Imported once the environment is set, the app reads it at import time
+  from app.index import DEFAULT_CORPUS_PATH
+  from app.main import app
+  from app.services.RAG import RAGService
+  from app.utils.auth import create_access_token
+
+  if args.live:
+    rag_service = RAGService()
+    rag_service.attach_index()
+  else:
+    from app.utils.LocalStandIns import InMemoryNeo4jStore
+    rag_service = RAGService(document_store=InMemoryNeo4jStore(query_latency=args.neo4j_latency))
+    corpus = args.corpus or DEFAULT_CORPUS_PATH
+    if not Path(corpus).exists():
+      corpus = str(synthetic_corpus(workdir))
+    rag_service.build_embeddings(path_to_markdown=corpus, incremental=False)
+  rag_service.build_query_pipeline()
+  rag_service.warm_up_models()
+  app.state.rag_service = rag_service
+  app.state.readiness.index_loaded(rag_service.index_version)
+  app.state.readiness.mark_ready()
+
+  stage_samples: Dict[str, List[float]] = defaultdict(list)
+  rag_service.stage_observers.append(lambda stage, seconds: stage_samples[stage].append(seconds))
+
+  questions = DEFAULT_QUESTIONS
+  if args.questions:
+    with open(args.questions, "r", encoding="utf-8") as f:
+      questions = [line.strip() for line in f if line.strip()]
+
+  server, thread, base_url = serve(app)
+  try:
+    load = asyncio.run(run_load(
+      base_url, create_access_token({"sub": "rag-benchmark"}), questions, args.requests, args.concurrency, args.endpoint))
+  finally:
+    server.should_exit = True
+    thread.join()
+    rag_service.close()
+    for server in fake_generators:
+      server.stop()
+
+  return {
+    "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    "mode": "live" if args.live else "local",
+    "endpoint": args.endpoint,
+    "requests": args.requests,
+    "concurrency": args.concurrency,
+    "questions": len(questions),
+    "workers": 1,
+    # Connections the API opened to the stand-in Ollama, with pooling far fewer than requests
+    "ollama_connections": sum(server.connections for server in fake_generators) if fake_generators else None,
+    "generation_backends": len(fake_generators) if fake_generators else None,
+    "settings": {key: os.getenv(key) for key in [
+      "RAG_MAX_CONCURRENT_QUERIES", "RAG_MAX_QUEUED_QUERIES", "RETRIEVAL_MODE", "VECTOR_ENGINE",
+      "RETRIEVER_TOP_K", "CACHE_BACKEND", "CACHE_MAX_ENTRIES", "OLLAMA_POOL_SIZE", "NEO4J_POOL_SIZE",
+      "OLLAMA_GENERATION_URLS", "OLLAMA_MAX_IN_FLIGHT", "GENERATION_MAX_QUEUED", "GENERATION_QUEUE_TIMEOUT"]},
+    **load,
+    "stages": {stage: percentiles(stage_samples.get(stage, [])) for stage in STAGES},
+  }
+
+
+def print_report(results: dict) -> None:
+  print(f"{results['requests']} requests to /{'query/stream' if results['endpoint'] == 'stream' else 'query'} "
+        f"at concurrency {results['concurrency']}: {results['requests_per_second'] or 0:.2f} req/s per worker, "
+        f"statuses {results['statuses']}")
+  if results["ollama_connections"] is not None:
+    print(f"{results['ollama_connections']} connections opened to Ollama")
+  rows = [("end-to-end", results["latency"])]
+  if results["time_to_first_token"]:
+    rows.append(("first token", results["time_to_first_token"]))
+  rows += list(results["stages"].items())
+  print(f"{'stage':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+  for name, stats in rows:
+    values = [f"{stats[key]:>10.1f}" if stats[key] is not None else f"{'-':>10}" for key in ("p50_ms", "p95_ms", "p99_ms")]
+    print(f"{name:<14}{stats['count']:>8}{''.join(values)}")
+
+
+def main() -> int:
+  parser = argparse.ArgumentParser(prog="python -m app.utils.RAGBenchmark", description="Load test the RAG API.")
+  parser.add_argument("--requests", type=int, default=200, help="Total questions to ask.")
+  parser.add_argument("--concurrency", type=int, default=16, help="Questions in flight at once.")
+  parser.add_argument("--endpoint", choices=["query", "stream"], default="query", help="/query or /query/stream.")
+  parser.add_argument("--questions", help="File with one question per line, cycled through.")
+  parser.add_argument("--corpus", help="Markdown file or corpus directory to index, synthetic if missing.")
+  parser.add_argument("--no-cache", action="store_true", help="Disable the embedding and answer caches.")
+  parser.add_argument("--live", action="store_true", help="Use the configured Ollama and Neo4j and the built index.")
+  parser.add_argument("--embed-latency", type=float, default=0.02, help="Fake Ollama seconds per embedding request.")
+  parser.add_argument("--first-token-latency", type=float, default=0.2, help="Fake Ollama seconds to first token.")
+  parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Fake Ollama generation speed.")
+  parser.add_argument("--answer-tokens", type=int, default=50, help="Fake Ollama tokens per answer.")
+  parser.add_argument("--ollama-parallel", type=int, default=4, help="Generations each fake Ollama runs at once.")
+  parser.add_argument("--generation-backends", type=int, default=1, help="Fake Ollama servers to generate on.")
+  parser.add_argument("--neo4j-latency", type=float, default=0.01, help="Stand-in Neo4j seconds per vector query.")
+  parser.add_argument("--output", help="Results JSON, data/benchmarks/rag-<timestamp>.json by default.")
+  args = parser.parse_args()
+
+  results = benchmark(args)
+  print_report(results)
+  output_path = Path(args.output) if args.output else \
+    DEFAULT_RESULTS_DIR / f"rag-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+  output_path.parent.mkdir(parents=True, exist_ok=True)
+  with open(output_path, "w", encoding="utf-8") as f:
+    json.dump(results, f, indent=2)
+  print(f"Benchmark results saved to: {output_path}")
+  return 0 if results["statuses"].get("200") == results["requests"] else 1
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,65 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+
+
+class ConcurrencyLimiter:
+    """
+    Per-worker admission control.
+
+    At most `max_concurrency` callers run at once and up to `max_queued` more
+    wait for a slot. Anything beyond that is rejected immediately with a 429,
+    a caller that waited `queue_timeout` seconds without getting a slot is
+    rejected with a 503, so a saturated worker fails fast instead of stalling.
+    """
+
+    def __init__(self, max_concurrency: int, max_queued: int = 0, queue_timeout: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = 0  # running + waiting
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._pending >= self.max_concurrency + self.max_queued:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Server is busy, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        try:
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail=f"No query slot available within {self.queue_timeout:g}s",
+                    headers={"Retry-After": str(max(1, int(self.queue_timeout)))},
+                )
+            try:
+                yield
+            finally:
+                self._semaphore.release()
+        finally:
+            self._pending -= 1
+
+
+def generation_urls() -> List[str]:
+    """Ollama servers that generate answers: OLLAMA_GENERATION_URLS (comma separated), else OLLAMA_BASE_URL."""
+    urls = [url.strip() for url in os.getenv("OLLAMA_GENERATION_URLS", "").split(",") if url.strip()]
+    return urls or [os.getenv("OLLAMA_BASE_URL")]
+
+
+def max_concurrent_queries() -> int:
+    """RAG_MAX_CONCURRENT_QUERIES, by default enough questions to keep every generation backend busy."""
+    default = len(generation_urls()) * int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "4"))
+    return int(os.getenv("RAG_MAX_CONCURRENT_QUERIES", str(default)))
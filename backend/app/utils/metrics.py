@@ -0,0 +1,299 @@
+import atexit
+import bisect
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition of the server's metrics, served on /metrics.
+# Each uvicorn worker counts in its own process and shares a snapshot through METRICS_DIR,
+# whichever worker serves the scrape renders the sum over all of them (see MetricsRegistry.share).
+
+DEFAULT_METRICS_DIR = Path(tempfile.gettempdir()) / "rules-lawyer-metrics"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def state(self) -> List[list]:
+        """JSON-serializable values of this process, [[label values, value], ...]."""
+        raise NotImplementedError
+
+    def merge(self, states: Iterable[List[list]]) -> Dict[LabelValues, Any]:
+        """Combines the states of every worker, counts add up."""
+        merged: Dict[LabelValues, Any] = {}
+        for state in states:
+            for labels, value in state:
+                key = tuple(labels)
+                merged[key] = merged[key] + value if key in merged else value
+        return merged
+
+    def samples(self, values: Dict[LabelValues, Any]) -> Iterable[str]:
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+    def render(self, states: Iterable[List[list]]) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(self.merge(states)),
+        ])
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def state(self) -> List[list]:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    Gauge read from a callback returning {label values: value}, when scraped or shared.
+    Only live workers count, their values add up, or with aggregate="max" the largest
+    is taken for state the workers share (e.g. a cache all of them use).
+    """
+    type = "gauge"
+    # Values of exited workers are dropped, unlike counts
+    live_only = True
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Dict[LabelValues, float]],
+        labelnames: Sequence[str] = (),
+        aggregate: str = "sum"
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.aggregate = aggregate
+
+    def state(self) -> List[list]:
+        return [[list(key), value] for key, value in self.callback().items()]
+
+    def merge(self, states: Iterable[List[list]]) -> Dict[LabelValues, Any]:
+        if self.aggregate != "max":
+            return super().merge(states)
+        merged: Dict[LabelValues, Any] = {}
+        for state in states:
+            for labels, value in state:
+                key = tuple(labels)
+                merged[key] = max(merged.get(key, value), value)
+        return merged
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: count per bucket (+Inf last), sum
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def state(self) -> List[list]:
+        with self._lock:
+            return [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+
+    def merge(self, states: Iterable[List[list]]) -> Dict[LabelValues, Any]:
+        merged: Dict[LabelValues, Any] = {}
+        for state in states:
+            for labels, (counts, total) in state:
+                key = tuple(labels)
+                if key in merged:
+                    merged_counts, merged_total = merged[key]
+                    merged[key] = ([a + b for a, b in zip(merged_counts, counts)], merged_total + total)
+                else:
+                    merged[key] = (list(counts), total)
+        return merged
+
+    def samples(self, values: Dict[LabelValues, Any]) -> Iterable[str]:
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+        self._directory: Optional[Path] = None
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            # Re-registering replaces, e.g. a gauge bound to a new RAGService
+            self._metrics[metric.name] = metric
+        return metric
+
+    def share(self, directory: Optional[str] = None, interval: float = 1.0) -> None:
+        """
+        Shares this process's metrics with the other workers of the server through files,
+        one per worker under a directory per server (named after the parent uvicorn process).
+        A snapshot is written every `interval` seconds and at exit, so a scrape is at most that stale.
+        Counts of exited workers stay in the totals until the server restarts.
+        """
+        root = Path(directory or os.getenv("METRICS_DIR") or DEFAULT_METRICS_DIR)
+        self._directory = root / str(os.getppid())
+        self._directory.mkdir(parents=True, exist_ok=True)
+        # Leftovers of servers that are gone
+        for server_directory in root.iterdir():
+            if server_directory.is_dir() and server_directory.name.isdigit() and not _alive(int(server_directory.name)):
+                shutil.rmtree(server_directory, ignore_errors=True)
+
+        def flush_periodically() -> None:
+            while True:
+                self.flush()
+                stop.wait(interval)
+
+        stop = threading.Event()
+        threading.Thread(target=flush_periodically, name="metrics-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def flush(self) -> None:
+        if self._directory is None:
+            return
+        path = self._directory / f"{os.getpid()}.json"
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._own_states(), f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error in metrics flush: {e}")
+
+    def _own_states(self) -> Dict[str, List[list]]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.state() for metric in metrics}
+
+    def _states(self) -> List[Tuple[Dict[str, List[list]], bool]]:
+        """(states, alive) of every worker, this one read live and the others from their last snapshot."""
+        states = [(self._own_states(), True)]
+        if self._directory is None:
+            return states
+        for path in self._directory.glob("*.json"):
+            pid = int(path.stem)
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    states.append((json.load(f), _alive(pid)))
+            except (OSError, ValueError):
+                # Replaced while being read, its next snapshot counts
+                continue
+        return states
+
+    def render(self) -> str:
+        """Text exposition of every worker's metrics, reads files: call it off the event loop."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        states = self._states()
+        return "\n".join(
+            metric.render(
+                worker_states[metric.name] for worker_states, alive in states
+                if metric.name in worker_states and (alive or not getattr(metric, "live_only", False)))
+            for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "rag_stage_duration_seconds", "Time spent per RAG stage.", labelnames=("stage",)))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "rag_prompt_tokens", "Prompt tokens sent to the generator, as counted by Ollama.", buckets=TOKEN_BUCKETS))
+COMPLETION_TOKENS = REGISTRY.register(Histogram(
+    "rag_completion_tokens", "Tokens generated per answer, as counted by Ollama.", buckets=TOKEN_BUCKETS))
+RETRIEVED_DOCUMENTS = REGISTRY.register(Histogram(
+    "rag_retrieved_documents", "Documents put into the prompt.", buckets=COUNT_BUCKETS))
+ANSWER_CACHE = REGISTRY.register(Counter(
+    "rag_answer_cache_total", "Answer cache lookups: exact hit, semantic hit or miss.", labelnames=("result",)))
+EMBEDDING_CACHE = REGISTRY.register(Counter(
+    "rag_embedding_cache_total", "Query embedding cache lookups.", labelnames=("result",)))
+GENERATION_REJECTED = REGISTRY.register(Counter(
+    "rag_generation_rejected_total", "Generations shed: queue full (429) or no backend before the deadline (503).",
+    labelnames=("reason",)))
+QUERIES = REGISTRY.register(Counter(
+    "rag_queries_total", "Questions handled, by mode (blocking or stream) and outcome.", labelnames=("mode", "status")))
+
+# Stage timings of the current request, set by callers that want a breakdown (see /query?timings=true)
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_DURATION.observe(seconds, stage=stage)
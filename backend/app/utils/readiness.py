@@ -0,0 +1,91 @@
+import threading
+import time
+from typing import Optional
+
+
+class Readiness:
+    """
+    Startup state of this worker, reported by /health/ready.
+
+    Warm-up goes through phases: importing the RAG modules, loading the
+    index, building the query pipeline, then loading the Ollama models.
+    The worker is ready once the models have answered, a failed step is
+    retried and its error reported meanwhile. Answers to the most asked
+    questions are precomputed after that, see `faq`. Updated from the
+    warm-up thread, read from the event loop.
+    """
+
+    STARTING = "starting"
+    IMPORTING = "importing"
+    LOADING_INDEX = "loading_index"
+    BUILDING_PIPELINE = "building_pipeline"
+    WARMING_MODELS = "warming_models"
+    READY = "ready"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._started_at = time.monotonic()
+        self._ready_after: Optional[float] = None
+        self.phase = self.STARTING
+        self.error: Optional[str] = None
+        self.index_version: Optional[str] = None
+        self.models_state = "cold"
+        self.models_error: Optional[str] = None
+        self.faq_state = "pending"
+        self.faq_answers = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.phase == self.READY
+
+    def enter(self, phase: str) -> None:
+        with self._lock:
+            self.phase = phase
+            if phase == self.WARMING_MODELS:
+                self.error = None
+                # Index and pipeline are in place, the rest only makes the first answers faster
+                self._loaded.set()
+
+    def index_loaded(self, index_version: Optional[str]) -> None:
+        with self._lock:
+            self.index_version = index_version
+
+    def models_failed(self, error: str) -> None:
+        with self._lock:
+            self.models_state = "unavailable"
+            self.models_error = error
+
+    def mark_ready(self, models_state: str = "warm") -> None:
+        with self._lock:
+            self.phase = self.READY
+            self.models_state = models_state
+            self.models_error = None
+            self._ready_after = time.monotonic() - self._started_at
+            self._loaded.set()
+
+    def faq_updated(self, state: str, answers: int) -> None:
+        with self._lock:
+            self.faq_state = state
+            self.faq_answers = answers
+
+    def retrying(self, error: str) -> None:
+        with self._lock:
+            self.error = error
+
+    def wait_loaded(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until the index and pipeline are loaded."""
+        return self._loaded.wait(timeout)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "status": "ready" if self.phase == self.READY else "starting",
+                "phase": self.phase,
+                "error": self.error,
+                "index": {"version": self.index_version},
+                "models": {"state": self.models_state, "error": self.models_error},
+                "faq": {"state": self.faq_state, "answers": self.faq_answers},
+                "uptime_seconds": round(time.monotonic() - self._started_at, 1),
+                "ready_after_seconds": round(self._ready_after, 1) if self._ready_after is not None else None,
+            }
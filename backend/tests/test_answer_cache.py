@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from app.services.AnswerCache import AnswerCache
+from app.services.CacheBackend import InMemoryCacheBackend, SQLiteCacheBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+  backend = (
+    InMemoryCacheBackend(max_entries=3) if request.param == "memory"
+    else SQLiteCacheBackend(path=str(tmp_path / "cache.sqlite3"), max_entries=3))
+  yield backend
+  backend.close()
+
+
+def embedding(i: int) -> list:
+  vector = np.zeros(8)
+  vector[i % 8] = 1.0
+  return list(vector)
+
+
+def test_semantic_hit_within_threshold(backend):
+  cache = AnswerCache(backend, similarity_threshold=0.9)
+  cache.set_index_version("v1")
+  cache.put("How do I dig?", embedding(0), "Spend an action.", [], scope="drg")
+  assert cache.get_semantic(np.array(embedding(0)) + 0.01, scope="drg").answer == "Spend an action."
+  assert cache.get_semantic(embedding(1), scope="drg") is None
+  # Answers never leak across games
+  assert cache.get_semantic(embedding(0), scope="other") is None
+
+
+def test_answers_and_embeddings_are_evicted_together(backend):
+  cache = AnswerCache(backend)
+  cache.set_index_version("v1")
+  for i in range(6):
+    cache.put(f"question {i}", embedding(i), f"answer {i}", [])
+  answer_keys = {key for key, _ in backend.items(cache.namespace)}
+  assert {key for key, _ in backend.vectors(cache.namespace)} == answer_keys
+  assert len(answer_keys) == 3
+  assert cache.get_semantic(embedding(0)) is None
+  assert cache.get_semantic(embedding(5)).answer == "answer 5"
+  assert cache.stats()["entries"] == 3
+
+
+def test_new_index_version_drops_answers(backend):
+  cache = AnswerCache(backend)
+  cache.set_index_version("v1")
+  cache.put("How do I dig?", embedding(0), "Spend an action.", [])
+  cache.set_index_version("v2")
+  assert cache.get_exact("How do I dig?") is None
+  assert cache.stats()["entries"] == 0
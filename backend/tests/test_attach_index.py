@@ -0,0 +1,38 @@
+import pytest
+
+from app.services.IndexManifest import IndexManifest
+from app.services.RAG import RAGService
+from app.utils.LocalStandIns import InMemoryNeo4jStore
+
+
+@pytest.fixture
+def rag_service(tmp_path, monkeypatch):
+  monkeypatch.setenv("INDEX_MANIFEST_PATH", str(tmp_path / "index_manifest.json"))
+  monkeypatch.setenv("QUERY_LOG_PATH", str(tmp_path / "query_log.sqlite3"))
+  monkeypatch.setenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+  rag_service = RAGService(document_store=InMemoryNeo4jStore())
+  yield rag_service
+  rag_service.close()
+
+
+def built_index(embedding_model: str) -> IndexManifest:
+  manifest = IndexManifest()
+  manifest.reset(hashes=["a", "b"], embedding_model=embedding_model)
+  manifest.save()
+  return manifest
+
+
+def test_attaches_to_an_index_of_the_same_model(rag_service):
+  manifest = built_index("nomic-embed-text")
+  assert rag_service.attach_index()
+  assert rag_service.index_version == manifest.version
+
+
+def test_refuses_an_index_of_another_model(rag_service):
+  built_index("mxbai-embed-large")
+  assert not rag_service.attach_index()
+  assert rag_service.index_version is None
+
+
+def test_refuses_a_missing_index(rag_service):
+  assert not rag_service.attach_index()
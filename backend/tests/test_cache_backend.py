@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from app.services.CacheBackend import InMemoryCacheBackend, SQLiteCacheBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+  backend = (
+    InMemoryCacheBackend(max_entries=2) if request.param == "memory"
+    else SQLiteCacheBackend(path=str(tmp_path / "cache.sqlite3"), max_entries=2))
+  yield backend
+  backend.close()
+
+
+def test_least_recently_used_is_evicted(backend):
+  backend.set("n", "a", 1)
+  time.sleep(0.01)
+  backend.set("n", "b", 2)
+  time.sleep(0.01)
+  # Reading "a" makes "b" the least recently used
+  assert backend.get("n", "a") == 1
+  time.sleep(0.01)
+  backend.set("n", "c", 3)
+  assert backend.get("n", "b") is None
+  assert sorted(backend.items("n")) == [("a", 1), ("c", 3)]
+  assert backend.count("n") == 2
+
+
+def test_namespaces_are_capped_separately(backend):
+  for key in "abc":
+    backend.set("one", key, key)
+  backend.set("two", "a", "a")
+  assert backend.count("one") == 2
+  assert backend.count("two") == 1
+
+
+def test_entries_expire(backend, monkeypatch):
+  now = time.time()
+  backend.set("n", "a", 1, ttl_seconds=10)
+  backend.set("n", "b", 2)
+  monkeypatch.setattr(time, "time", lambda: now + 11)
+  assert backend.get("n", "a") is None
+  assert backend.items("n") == [("b", 2)]
+  assert backend.count("n") == 1
+
+
+def test_vectors_are_read_without_values(backend):
+  backend.set("n", "a", {"answer": 1}, vector=b"\x00\x01")
+  backend.set("n", "b", {"answer": 2})
+  assert backend.vectors("n") == [("a", b"\x00\x01")]
+
+
+def test_clear(backend):
+  backend.set("n", "a", 1)
+  backend.clear("n")
+  assert backend.get("n", "a") is None
+  assert backend.count("n") == 0
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+  backend = SQLiteCacheBackend(path=str(tmp_path / "cache.sqlite3"), max_entries=0)
+  backend.set("n", "a", 1)
+  assert backend.get("n", "a") is None
+
+
+def test_sqlite_cache_is_shared_across_connections(tmp_path):
+  path = str(tmp_path / "cache.sqlite3")
+  SQLiteCacheBackend(path=path).set("n", "a", 1)
+  assert SQLiteCacheBackend(path=path).get("n", "a") == 1
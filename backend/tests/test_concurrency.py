@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils.concurrency import ConcurrencyLimiter
+
+
+async def hold(limiter: ConcurrencyLimiter, release: asyncio.Event) -> None:
+  async with limiter.slot():
+    await release.wait()
+
+
+def test_queue_full_is_rejected_at_once():
+  async def scenario():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queued=1, queue_timeout=5)
+    release = asyncio.Event()
+    holders = [asyncio.create_task(hold(limiter, release)) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert limiter.pending == 2
+    with pytest.raises(HTTPException) as rejected:
+      async with limiter.slot():
+        pass
+    release.set()
+    await asyncio.gather(*holders)
+    return rejected.value, limiter.pending
+
+  rejected, pending = asyncio.run(scenario())
+  assert rejected.status_code == 429
+  assert pending == 0
+
+
+def test_waiting_past_the_timeout_is_rejected():
+  async def scenario():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queued=1, queue_timeout=0.05)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(limiter, release))
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPException) as rejected:
+      async with limiter.slot():
+        pass
+    release.set()
+    await holder
+    return rejected.value, limiter.pending
+
+  rejected, pending = asyncio.run(scenario())
+  assert rejected.status_code == 503
+  assert rejected.headers["Retry-After"] == "1"
+  assert pending == 0
+
+
+def test_queued_caller_gets_the_freed_slot():
+  async def scenario():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queued=1, queue_timeout=5)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(limiter, release))
+    await asyncio.sleep(0)
+    asyncio.get_running_loop().call_later(0.01, release.set)
+    async with limiter.slot():
+      running = limiter.pending
+    await holder
+    return running
+
+  assert asyncio.run(scenario()) == 1
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import httpx
+import pytest
+
+from app.services.GenerationScheduler import GenerationBackend, GenerationRejected, GenerationScheduler
+
+
+def scheduler(*max_in_flight: int, **kwargs) -> GenerationScheduler:
+  backends = [
+    GenerationBackend(url=f"http://ollama-{i}", generator=None, max_in_flight=limit)
+    for i, limit in enumerate(max_in_flight)]
+  return GenerationScheduler(backends, **kwargs)
+
+
+def test_connection_error_puts_the_backend_in_cooldown():
+  generation = scheduler(1, 1, cooldown=60)
+  with pytest.raises(httpx.ConnectError):
+    with generation.slot() as backend:
+      raise httpx.ConnectError("refused")
+  down = backend
+  assert down.down_until > time.monotonic()
+  for _ in range(3):
+    with generation.slot() as backend:
+      assert backend is not down
+
+
+def test_read_timeout_leaves_the_backend_available():
+  generation = scheduler(1, cooldown=60)
+  with pytest.raises(httpx.ReadTimeout):
+    with generation.slot():
+      raise httpx.ReadTimeout("slow")
+  with generation.slot(timeout=0.05) as backend:
+    assert backend.down_until == 0.0
+    assert backend.in_flight == 1
+
+
+def test_least_loaded_backend_is_picked():
+  generation = scheduler(2, 2)
+  with generation.slot() as first, generation.slot() as second:
+    assert first is not second
+
+
+def test_queue_full_is_rejected_with_429():
+  generation = scheduler(1, max_queued=0)
+  with generation.slot():
+    with pytest.raises(GenerationRejected) as rejected:
+      with generation.slot():
+        pass
+  assert rejected.value.status_code == 429
+
+
+def test_deadline_is_rejected_with_503():
+  generation = scheduler(1, max_queued=1)
+  with generation.slot():
+    with pytest.raises(GenerationRejected) as rejected:
+      with generation.slot(timeout=0.05):
+        pass
+  assert rejected.value.status_code == 503
+
+
+def test_waiting_request_gets_the_freed_backend():
+  generation = scheduler(1, max_queued=1)
+  got = []
+
+  def wait():
+    with generation.slot(timeout=5) as backend:
+      got.append(backend.in_flight)
+
+  with generation.slot():
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.05)
+    assert not got
+  waiter.join(1)
+  assert got == [1]
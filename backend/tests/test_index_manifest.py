@@ -0,0 +1,38 @@
+from app.services.IndexManifest import IndexManifest, chunk_hash
+
+
+def test_round_trip(tmp_path):
+  manifest = IndexManifest(path=str(tmp_path / "index_manifest.json"))
+  manifest.reset(hashes=["b", "a"], embedding_model="nomic-embed-text")
+  manifest.save()
+  loaded = IndexManifest(path=str(tmp_path / "index_manifest.json")).load()
+  assert loaded.hashes == {"a", "b"}
+  assert loaded.embedding_model == "nomic-embed-text"
+  assert loaded.version == manifest.version
+
+
+def test_version_changes_with_the_embedding_model(tmp_path):
+  manifest = IndexManifest(path=str(tmp_path / "index_manifest.json"))
+  manifest.reset(hashes=["a"], embedding_model="nomic-embed-text")
+  version = manifest.version
+  manifest.reset(hashes=["a"], embedding_model="mxbai-embed-large")
+  assert manifest.version != version
+
+
+def test_version_changes_with_the_chunks(tmp_path):
+  manifest = IndexManifest(path=str(tmp_path / "index_manifest.json"))
+  manifest.reset(hashes=["a"], embedding_model="nomic-embed-text")
+  version = manifest.version
+  manifest.hashes.add("b")
+  assert manifest.version != version
+
+
+def test_missing_manifest_loads_empty(tmp_path):
+  manifest = IndexManifest(path=str(tmp_path / "index_manifest.json")).load()
+  assert manifest.hashes == set()
+  assert manifest.embedding_model is None
+
+
+def test_chunk_hash_is_scoped_by_game():
+  assert chunk_hash("Roll a die.", scope="drg") != chunk_hash("Roll a die.", scope="other")
+  assert chunk_hash("Roll a die.") == chunk_hash("Roll a die.")
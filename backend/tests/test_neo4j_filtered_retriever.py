@@ -0,0 +1,74 @@
+import pytest
+from haystack import Document
+from neo4j_haystack import Neo4jDocumentStore
+from neo4j_haystack.document_stores.neo4j_store import _DefaultDocumentMarshaller
+
+from app.services.Neo4jFilteredRetriever import Neo4jFilteredRetriever, create_filter_index, where_clause
+
+GAME_FILTER = {"field": "meta.game", "operator": "==", "value": "drg"}
+
+
+class RecordingClient:
+  def __init__(self, records):
+    self.records = records
+    self.queries = []
+
+  def execute_read(self, query, parameters=None):
+    self.queries.append((query, parameters))
+    return None, self.records
+
+  def execute_write(self, query, parameters=None):
+    self.queries.append((query, parameters))
+
+  def close_driver(self):
+    pass
+
+
+def neo4j_store(client) -> Neo4jDocumentStore:
+  # Skips the constructor, it connects to Neo4j
+  store = Neo4jDocumentStore.__new__(Neo4jDocumentStore)
+  store.neo4j_client = client
+  store.node_label = "Document"
+  store.embedding_field = "embedding"
+  store.similarity = "cosine"
+  return store
+
+
+def test_game_filter_matches_the_marshalled_property():
+  # Pinned against neo4j-haystack's marshaller, it flattens meta onto the node
+  node = _DefaultDocumentMarshaller().marshal(Document(content="rule", meta={"game": "drg", "section": "Mining"}))
+  clause, parameters = where_clause(GAME_FILTER)
+  assert clause == "WHERE doc.`game` = $p0"
+  assert parameters == {"p0": "drg"}
+  assert "game" in node and "meta_game" not in node
+
+
+def test_nested_filters():
+  clause, parameters = where_clause({"operator": "AND", "conditions": [
+    GAME_FILTER,
+    {"field": "meta.section", "operator": "not in", "value": ["Index"]},
+  ]})
+  assert clause == "WHERE (doc.`game` = $p0 AND NOT doc.`section` IN $p1)"
+  assert parameters == {"p0": "drg", "p1": ["Index"]}
+
+
+def test_unsupported_operator():
+  with pytest.raises(ValueError):
+    where_clause({"field": "meta.game", "operator": "~=", "value": "drg"})
+
+
+def test_filtered_query_maps_records_to_documents():
+  client = RecordingClient([{"doc": {"id": "1", "content": "rule", "game": "drg", "embedding": None}, "score": 0.5}])
+  retriever = Neo4jFilteredRetriever(neo4j_store(client), top_k=3)
+  documents = retriever.run(query_embedding=[0.1, 0.2], filters=GAME_FILTER)["documents"]
+  query, parameters = client.queries[0]
+  assert "MATCH (doc:`Document`) WHERE doc.`game` = $p0" in query
+  assert parameters == {"embedding": [0.1, 0.2], "top_k": 3, "p0": "drg"}
+  assert documents[0].meta == {"game": "drg"}
+  assert documents[0].score == 0.75
+
+
+def test_filter_index_is_on_the_filtered_property():
+  client = RecordingClient([])
+  create_filter_index(neo4j_store(client))
+  assert client.queries == [("CREATE INDEX `Document_game` IF NOT EXISTS FOR (doc:`Document`) ON (doc.`game`)", None)]
@@ -0,0 +1,27 @@
+from haystack import Document
+
+from app.services.Corpus import split_pages
+from app.services.MarkdownSectionSplitter import MarkdownSectionSplitter
+
+PAGED = "# Rules\n\nDig down.\n\n\f\n\n## Combat\n\nShoot bugs.\n\n\f\n\nReload.\n\n\f\n\n"
+
+
+def test_split_pages_numbers_non_blank_pages():
+  assert [page for page, _ in split_pages(PAGED)] == [1, 2, 3]
+  assert split_pages("No breaks") == [(None, "No breaks")]
+
+
+def test_sections_keep_their_heading_across_pages():
+  chunks = MarkdownSectionSplitter(max_words=300).run(documents=[Document(content=PAGED)])["documents"]
+  assert [(chunk.meta["heading_path"], chunk.meta["page"]) for chunk in chunks] == [("Rules", 1), ("Rules > Combat", 2)]
+  assert "Reload." in chunks[1].content
+
+
+def test_chunks_start_their_page_when_cut():
+  chunks = MarkdownSectionSplitter(max_words=5).run(documents=[Document(content=PAGED)])["documents"]
+  assert [chunk.meta["page"] for chunk in chunks] == [1, 2, 3]
+
+
+def test_no_page_without_page_breaks():
+  chunks = MarkdownSectionSplitter().run(documents=[Document(content="# Rules\n\nDig down.")])["documents"]
+  assert "page" not in chunks[0].meta